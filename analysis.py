@@ -1,44 +1,58 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
-import statsmodels.api as sm
-from const import DATA_PATH, SPECIFIED_COUNTRIES
-from data_process import (
-    process_Carbon_data,
-    process_Disaster_data,
-    process_Temperature_data,
+from const import (
+    ANALYSIS_BACKEND,
+    DATA_PATH,
+    RESAMPLING_BATCH_SIZE,
+    RESAMPLING_REPLICATES,
+    RESAMPLING_SEED,
+    RESAMPLING_WORKERS,
+    WORLD,
+    YEARS,
 )
+from cube import query_cube
+from data_process import load_dataset
+from database import open_database
+from profiling import enable as enable_profiling, profiled, report_profile
+from regression import fit_grouped_ols, resample_grouped_ols
 
 class Analysis:
-    def __init__(self, path=DATA_PATH):
-        self.df_Carbon = process_Carbon_data(path)
-        self.df_Temperature = process_Temperature_data(path)
-        self.df_Disaster = process_Disaster_data(
-            DATA_PATH, SPECIFIED_COUNTRIES, "ROW", "WORLD"
+    def __init__(self, path=DATA_PATH, backend=ANALYSIS_BACKEND):
+        # Monthly aggregates of the processed datasets, as the cube frame or
+        # as the embedded database answering the same queries in SQL
+        if backend == "pandas":
+            self.cube = load_dataset("Cube", path)
+        elif backend == "sql":
+            self.cube = open_database(path)
+        else:
+            raise ValueError(f"Unknown analysis backend {backend!r}")
+
+    @profiled
+    def prepare_data_for_analysis(self):
+        # Count the number of disasters per month for each year,
+        # leaving out the 'WORLD' totals
+        df_Disaster_Count = query_cube(
+            self.cube, "Disaster", exclude_countries=[WORLD]
+        )
+        df_Disaster_Count = df_Disaster_Count[["Year", "Month", "Count"]].rename(
+            columns={"Count": "Disaster Count"}
         )
 
-    def prepare_data_for_analysis(self):
         # Filter for 'WORLD' country
-        df_Disaster_World = self.df_Disaster[self.df_Disaster["Country"] != "WORLD"]
-        df_Carbon_World = self.df_Carbon[self.df_Carbon["Country"] == "WORLD"]
-        df_Temperature_World = self.df_Temperature[
-            self.df_Temperature["Country"] == "WORLD"
-        ]
-
-        # Count the number of disasters per month for each year
-        df_Disaster_Count = (
-            df_Disaster_World.groupby(["Year", "Month"])
-            .size()
-            .reset_index(name="Disaster Count")
+        df_Carbon_Count = query_cube(self.cube, "Carbon", countries=[WORLD])
+        df_Carbon_Count = df_Carbon_Count[["Year", "Month", "Sum"]].rename(
+            columns={"Sum": "Value"}
         )
-        df_Carbon_Count = (
-            df_Carbon_World.groupby(["Year", "Month"])
-            .agg({"Value": "sum"})
-            .reset_index()
+        df_Temperature_Count = query_cube(
+            self.cube, "Temperature", "Monthly Anomaly", countries=[WORLD]
         )
-        df_Temperature_Count = (
-            df_Temperature_World.groupby(["Year", "Month"])
-            .agg({"Monthly Anomaly": "mean"})
-            .reset_index()
+        df_Temperature_Count["Monthly Anomaly"] = (
+            df_Temperature_Count["Sum"] / df_Temperature_Count["Count"]
         )
+        df_Temperature_Count = df_Temperature_Count[
+            ["Year", "Month", "Monthly Anomaly"]
+        ]
 
         return df_Disaster_Count, df_Carbon_Count, df_Temperature_Count
 
@@ -56,72 +70,117 @@ class Analysis:
     
     # Linear Regression Analysis for Monthly Carbon Emissions and Temperature Anomalies
     @staticmethod
-    def perform_monthly_regression_analysis(df_Carbon_Count, df_Temperature_Count):
-        results = {}
-
+    @profiled
+    def perform_monthly_regression_analysis(
+        df_Carbon_Count, df_Temperature_Count, years=YEARS
+    ):
         merged_data = pd.merge(df_Carbon_Count, df_Temperature_Count, on=["Year", "Month"])
+        merged_data = merged_data[merged_data["Year"].isin(years)]
 
-        for year in [2019, 2020]:
-            yearly_data = merged_data[merged_data["Year"] == year]
-
-            X = yearly_data["Value"]  # CO2 Emissions
-            y = yearly_data["Monthly Anomaly"]  # Temperature Anomalies
-            X = sm.add_constant(X)
-            model = sm.OLS(y, X).fit()
-
-            results[year] = Analysis.format_regression_results(model)
-
-        return results
+        # Temperature Anomalies on CO2 Emissions, one fit per year in one batch
+        return fit_grouped_ols(merged_data, "Monthly Anomaly", "Value", by="Year")
 
     # Linear Regression Analysis for Monthly Carbon Emissions and Disaster Count
     @staticmethod
-    def perform_disaster_co2_regression_analysis(df_Disaster_Count, df_Carbon_Count):
-        results = {}
-
+    @profiled
+    def perform_disaster_co2_regression_analysis(
+        df_Disaster_Count, df_Carbon_Count, years=YEARS
+    ):
         merged_data = pd.merge(df_Disaster_Count, df_Carbon_Count, on=["Year", "Month"])
+        merged_data = merged_data[merged_data["Year"].isin(years)]
 
-        for year in [2019, 2020]:
-            yearly_data = merged_data[merged_data["Year"] == year]
-
-            X = yearly_data["Disaster Count"]  # Number of Disasters
-            y = yearly_data["Value"]  # CO2 Emissions
-            X = sm.add_constant(X)
-            model = sm.OLS(y, X).fit()
-
-            results[year] = Analysis.format_regression_results(model)
-
-        return results
+        # CO2 Emissions on Number of Disasters, one fit per year in one batch
+        return fit_grouped_ols(merged_data, "Value", "Disaster Count", by="Year")
 
     # Multiple Linear Regression Analysis for Monthly Carbon Emissions, Temperature Anomalies, and Disaster Count
     @staticmethod
-    def perform_multiple_regression_analysis(df_Disaster_Count, df_Carbon_Count, df_Temperature_Count):
-        results = {}
-
+    @profiled
+    def perform_multiple_regression_analysis(
+        df_Disaster_Count, df_Carbon_Count, df_Temperature_Count, years=YEARS
+    ):
         merged_data = pd.merge(df_Disaster_Count, df_Carbon_Count, on=["Year", "Month"])
         merged_data = pd.merge(merged_data, df_Temperature_Count, on=["Year", "Month"])
+        merged_data = merged_data[merged_data["Year"].isin(years)]
 
-        for year in [2019, 2020]:
-            yearly_data = merged_data[merged_data["Year"] == year]
-
-            X = yearly_data[["Disaster Count", "Monthly Anomaly"]]  # Number of Disasters and Temperature Anomalies
-            y = yearly_data["Value"]  # CO2 Emissions
-            X = sm.add_constant(X)
-            model = sm.OLS(y, X).fit()
+        # CO2 Emissions on Number of Disasters and Temperature Anomalies,
+        # one fit per year in one batch
+        return fit_grouped_ols(
+            merged_data, "Value", ["Disaster Count", "Monthly Anomaly"], by="Year"
+        )
 
-            results[year] = Analysis.format_regression_results(model)
+    # Bootstrap percentile intervals and permutation p-values for the three
+    # regressions above, with twelve monthly observations per year the
+    # t-based p-values are fragile. All replicates share one process pool.
+    @profiled
+    def perform_resampling_inference(
+        self,
+        n_replicates=RESAMPLING_REPLICATES,
+        seed=RESAMPLING_SEED,
+        workers=RESAMPLING_WORKERS,
+        years=YEARS,
+    ):
+        (
+            df_Disaster_Count,
+            df_Carbon_Count,
+            df_Temperature_Count,
+        ) = self.prepare_data_for_analysis()
+
+        monthly_data = pd.merge(df_Carbon_Count, df_Temperature_Count, on=["Year", "Month"])
+        disaster_co2_data = pd.merge(df_Disaster_Count, df_Carbon_Count, on=["Year", "Month"])
+        multiple_data = pd.merge(disaster_co2_data, df_Temperature_Count, on=["Year", "Month"])
+        specifications = {
+            "Monthly": (monthly_data, "Monthly Anomaly", "Value"),
+            "Disaster-CO2": (disaster_co2_data, "Value", "Disaster Count"),
+            "Multiple": (multiple_data, "Value", ["Disaster Count", "Monthly Anomaly"]),
+        }
 
+        results = {}
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for name, (data, y, x) in specifications.items():
+                results[name] = resample_grouped_ols(
+                    data[data["Year"].isin(years)],
+                    y,
+                    x,
+                    by="Year",
+                    n_replicates=n_replicates,
+                    seed=seed,
+                    batch_size=RESAMPLING_BATCH_SIZE,
+                    pool=pool,
+                )
         return results
 
 
 if __name__ == "__main__":
-    analysis = Analysis(DATA_PATH)
+    parser = argparse.ArgumentParser(description="Run the regression analysis")
+    parser.add_argument(
+        "--resampling",
+        action="store_true",
+        help="add bootstrap intervals and permutation p-values",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["pandas", "sql"],
+        default=ANALYSIS_BACKEND,
+        help="answer the queries from the cube frame or the embedded database",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="",
+        help="profile every stage, optionally exporting to a .json/.csv file",
+    )
+    args = parser.parse_args()
+    if args.profile is not None:
+        enable_profiling()
+
+    analysis = Analysis(DATA_PATH, args.backend)
     (
         df_Disaster_Count,
         df_Carbon_Count,
         df_Temperature_Count,
     ) = analysis.prepare_data_for_analysis()
 
-    # Perform regression analysis and print formatted results for 2019 and 2020
+    # Perform regression analysis and print formatted results for every year
     regression_results = analysis.perform_monthly_regression_analysis(
         df_Carbon_Count, df_Temperature_Count
     )
@@ -141,3 +200,12 @@ if __name__ == "__main__":
     )
     for year, result in regression_results.items():
         print(f"Multiple Regression Results for the Year {year}:\n", result, "\n")
+
+    if args.resampling:
+        inference_results = analysis.perform_resampling_inference()
+        for name, yearly_results in inference_results.items():
+            for year, result in yearly_results.items():
+                print(f"{name} Resampling Results for the Year {year}:\n", result, "\n")
+
+    if args.profile is not None:
+        report_profile(args.profile)
@@ -1,9 +1,7 @@
-from shiny import App, render, ui
-from plotting import (
-    plot_monthly_temperature_anomalies, 
-    plot_monthly_carbon_emissions, 
-    plot_disaster_frequency, 
-    plot_sentiment_disaster_comparison)
+from shiny import App, reactive, render, ui
+from const import DASHBOARD_PREFETCH, PROFILING, YEARS
+from profiling import profile_stage
+from render_pool import RenderPool
 
 app_ui = ui.page_fluid(
     ui.tags.header(
@@ -20,40 +18,59 @@ app_ui = ui.page_fluid(
             ui.markdown("**Course:** PPHA 30538: Data and Programming for Public Policy II"),
             ui.markdown("**Assignment:** Final Project"),
 
-            ui.input_radio_buttons("year", "Year", [2019, 2020]),
+            ui.input_radio_buttons("year", "Year", YEARS),
+            ui.input_checkbox("log_latency", "Log request latency", PROFILING),
         ),
         ui.navset_tab(
-            ui.nav("Temperature Anomalies", ui.output_plot(id="monthly_temperature_anomalies")),
-            ui.nav("Carbon Emissions", ui.output_plot(id="monthly_carbon_emissions")),
-            ui.nav("Disaster Frequency", ui.output_plot(id="disaster_frequency")),
-            ui.nav("Sentiment Comparison", ui.output_plot(id="sentiment_disaster_comparison")),
+            ui.nav("Temperature Anomalies", ui.output_image(id="monthly_temperature_anomalies", height="auto")),
+            ui.nav("Carbon Emissions", ui.output_image(id="monthly_carbon_emissions", height="auto")),
+            ui.nav("Disaster Frequency", ui.output_image(id="disaster_frequency", height="auto")),
+            ui.nav("Sentiment Comparison", ui.output_image(id="sentiment_disaster_comparison", height="auto")),
         )
     )
 )
 
+# Plots are rendered once per (plot, year, data version) into the render
+# cache and served from there, so sessions share every rendered image.
+# Rendering runs in a background pool shared by every session, so a slow
+# plot never blocks the event loop serving the other sessions.
+render_pool = RenderPool()
+
+# With log_latency the wall time taken by each request is recorded and
+# printed. The render runs in a pool worker while this process serves other
+# sessions, so no CPU time is attributed to the request here.
+async def plot_image(plot, year, log_latency=False):
+    with profile_stage(f"dashboard {plot}", force=log_latency, local=False) as record:
+        src = await render_pool.render(plot, year)
+    if log_latency:
+        print(f"{plot} {year}: {record['Wall Seconds']:.3f}s wall")
+    return {"src": src, "width": "100%"}
+
 def server(input, output, session):
+    # Render every tab of a newly selected year in the background
+    if DASHBOARD_PREFETCH:
+        @reactive.Effect
+        def prefetch_year():
+            render_pool.prefetch(int(input.year()))
+
     @output
-    @render.plot
-    def monthly_temperature_anomalies():
-        year = int(input.year())
-        plot_monthly_temperature_anomalies(year)
+    @render.image(delete_file=False)
+    async def monthly_temperature_anomalies():
+        return await plot_image("monthly_temperature_anomalies", int(input.year()), input.log_latency())
 
     @output
-    @render.plot
-    def monthly_carbon_emissions():
-        year = int(input.year())
-        plot_monthly_carbon_emissions(year)
+    @render.image(delete_file=False)
+    async def monthly_carbon_emissions():
+        return await plot_image("monthly_carbon_emissions", int(input.year()), input.log_latency())
 
     @output
-    @render.plot
-    def disaster_frequency():
-        year = int(input.year())
-        plot_disaster_frequency(year)
+    @render.image(delete_file=False)
+    async def disaster_frequency():
+        return await plot_image("disaster_frequency", int(input.year()), input.log_latency())
 
     @output
-    @render.plot
-    def sentiment_disaster_comparison():
-        year = int(input.year())
-        plot_sentiment_disaster_comparison(year)
+    @render.image(delete_file=False)
+    async def sentiment_disaster_comparison():
+        return await plot_image("sentiment_disaster_comparison", int(input.year()), input.log_latency())
 
 app = App(app_ui, server)
@@ -0,0 +1,459 @@
+"""This file contains the benchmark suite of the pipeline on synthetic data."""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import time
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from const import (
+    BENCHMARK_CHUNK_SIZE,
+    BENCHMARK_PATH,
+    BENCHMARK_ROWS,
+    BENCHMARK_SEED,
+    SENTIMENT_CACHE_NAME,
+    SPECIFIED_COUNTRIES,
+    TOPIC_KEYWORDS,
+    WORD_CLOUD_KEYWORDS,
+    YEARS,
+)
+from analysis import Analysis
+from data_process import (
+    PIPELINE_STAGES,
+    clear_dataset_cache,
+    load_dataset,
+    load_year_slice,
+    run_stage,
+)
+from plotting import (
+    plot_disaster_frequency,
+    plot_monthly_carbon_emissions,
+    plot_monthly_temperature_anomalies,
+    plot_sentiment_disaster_comparison,
+)
+from profiling import clear, enable, profile_records, profile_stage, profile_summary
+
+# Countries of the synthetic rows, spelled like the raw sources spell them
+CARBON_COUNTRIES = SPECIFIED_COUNTRIES + ["ROW", "WORLD", "EU27 & UK"]
+CARBON_SECTORS = [
+    "Power",
+    "Industry",
+    "Ground Transport",
+    "Residential",
+    "Domestic Aviation",
+    "International Aviation",
+]
+DISASTER_COUNTRIES = [
+    "China",
+    "United States of America (the)",
+    "India",
+    "United Kingdom of Great Britain and Northern Ireland (the)",
+    "France",
+    "Germany",
+    "Italy",
+    "Spain",
+    "Russian Federation (the)",
+    "Japan",
+    "Brazil",
+    "Indonesia",
+    "Philippines (the)",
+    "Bangladesh",
+    "Mexico",
+    "Chad",
+]
+DISASTER_TYPES = [
+    "Flood",
+    "Storm",
+    "Earthquake",
+    "Extreme temperature",
+    "Landslide",
+    "Drought",
+    "Wildfire",
+]
+DISASTER_COLUMNS = [
+    "Disaster Type",
+    "Disaster Subtype",
+    "Disaster Group",
+    "Disaster Subgroup",
+    "Event Name",
+    "Origin",
+    "Country",
+    "Location",
+    "Latitude",
+    "Longitude",
+    "start_date",
+    "end_date",
+    "Total Deaths",
+    "No Affected",
+    "Reconstruction Costs ('000 US$)",
+    "Total Damages ('000 US$)",
+    "CPI",
+]
+REDDIT_COLUMNS = [
+    "comment_id",
+    "score",
+    "self_text",
+    "subreddit",
+    "created_time",
+    "post_id",
+    "post_title",
+    "post_self_text",
+    "post_created_time",
+]
+# Plain words mixed with the topic and word cloud keywords into the texts
+FILLER_WORDS = (
+    "the people think this is going to be really bad for our future because "
+    "nobody wants to pay for it and scientists have been saying so for years "
+    "good great terrible awful hope sad happy wrong right data model study"
+).split()
+
+# Synthetic dates span the pipeline years and the years around them, so the
+# year filters of the stages have rows to drop
+SYNTHETIC_YEARS = list(range(YEARS[0] - 2, YEARS[-1] + 3))
+
+
+# Random dates over the synthetic years. With `every_month` the i-th date
+# falls in the i-th month (cycling), so as few dates as there are months
+# cover each of them.
+def _dates(rng, size, with_time=False, every_month=False):
+    start = np.datetime64(f"{SYNTHETIC_YEARS[0]}-01-01", "s")
+    end = np.datetime64(f"{SYNTHETIC_YEARS[-1] + 1}-01-01", "s")
+    if every_month:
+        months = np.arange(size) % (len(SYNTHETIC_YEARS) * 12)
+        month_starts = np.datetime64(f"{SYNTHETIC_YEARS[0]}-01", "M") + months
+        start = month_starts.astype("datetime64[s]")
+        end = (month_starts + 1).astype("datetime64[s]")
+    seconds = rng.integers(0, (end - start).astype("int64"), size=size)
+    dates = start + seconds.astype("timedelta64[s]")
+    if not with_time:
+        dates = dates.astype("datetime64[D]")
+    return pd.Series(dates.astype(str)).str.replace("T", " ")
+
+
+def _texts(rng, size, words, keywords, keyword_share):
+    texts = []
+    for _ in range(size):
+        text = list(rng.choice(words, size=rng.integers(5, 40)))
+        if rng.random() < keyword_share:
+            text.insert(rng.integers(0, len(text)), rng.choice(keywords))
+        texts.append(" ".join(text))
+    return np.array(texts, dtype=object)
+
+
+# Write `rows` rows made by make_chunk(rng, size, offset) to a CSV file,
+# a chunk at a time, so files larger than memory can be generated
+def _write_chunks(file_path, rows, make_chunk, rng, chunksize):
+    with open(file_path, "w", newline="") as file:
+        for offset in range(0, rows, chunksize):
+            chunk = make_chunk(rng, min(chunksize, rows - offset), offset)
+            chunk.to_csv(file, index=False, header=offset == 0)
+    return rows
+
+
+# Like the Carbon Monitor feed, every day has a row per country and sector.
+# Days are spread over every month of the synthetic years first, so any size
+# from 10k rows on covers each month.
+def generate_Carbon(file_path, rows, rng, chunksize=BENCHMARK_CHUNK_SIZE):
+    cells = len(CARBON_COUNTRIES) * len(CARBON_SECTORS)
+    months = len(SYNTHETIC_YEARS) * 12
+
+    def make_chunk(rng, size, offset):
+        index = np.arange(offset, offset + size)
+        day, cell = index // cells, index % cells
+        month = day % months
+        dates = pd.Series(
+            [
+                f"{SYNTHETIC_YEARS[0] + m // 12}-{m % 12 + 1:02d}-{d % 28 + 1:02d}"
+                for m, d in zip(month, day // months)
+            ]
+        )
+        return pd.DataFrame(
+            {
+                "country": np.array(CARBON_COUNTRIES)[cell // len(CARBON_SECTORS)],
+                "date": dates,
+                "sector": np.array(CARBON_SECTORS)[cell % len(CARBON_SECTORS)],
+                "value": rng.gamma(2.0, 2.0, size).round(6),
+                "timestamp": rng.integers(1_500_000_000, 1_700_000_000, size),
+            }
+        )
+
+    return _write_chunks(file_path, rows, make_chunk, rng, chunksize)
+
+
+# Comments and post titles are drawn from pools of distinct texts, as real
+# threads repeat posts and quote comments, which the stages deduplicate
+def generate_Reddit(file_path, rows, rng, chunksize=BENCHMARK_CHUNK_SIZE):
+    topic_words = [word for words in TOPIC_KEYWORDS.values() for word in words]
+    comments = _texts(
+        rng, min(max(rows // 4, 1), 100_000), FILLER_WORDS, WORD_CLOUD_KEYWORDS, 0.3
+    )
+    titles = _texts(rng, min(max(rows // 50, 1), 20_000), FILLER_WORDS, topic_words, 0.7)
+    # Every comment of a post repeats the post's creation time. Posts are
+    # spread over every month first, so small runs still cover each month.
+    post_times = _dates(rng, len(titles), with_time=True, every_month=True).to_numpy()
+
+    def make_chunk(rng, size, offset):
+        posts = rng.integers(0, len(titles), size)
+        return pd.DataFrame(
+            {
+                "comment_id": [f"c{index:x}" for index in range(offset, offset + size)],
+                "score": rng.integers(-5, 500, size),
+                "self_text": comments[rng.integers(0, len(comments), size)],
+                "subreddit": "climatechange",
+                "created_time": _dates(rng, size, with_time=True),
+                "post_id": [f"p{post:x}" for post in posts],
+                "post_title": titles[posts],
+                "post_self_text": np.where(posts % 3 == 0, titles[posts], ""),
+                "post_created_time": post_times[posts],
+            },
+            columns=REDDIT_COLUMNS,
+        )
+
+    return _write_chunks(file_path, rows, make_chunk, rng, chunksize)
+
+
+def generate_Disaster(file_path, rows, rng, chunksize=BENCHMARK_CHUNK_SIZE):
+    def make_chunk(rng, size, offset):
+        deaths = rng.negative_binomial(1, 0.05, size).astype("float64")
+        deaths[rng.random(size) < 0.2] = np.nan
+        chunk = pd.DataFrame(
+            {
+                "Disaster Type": rng.choice(DISASTER_TYPES, size),
+                "Disaster Group": "Natural",
+                "Country": rng.choice(DISASTER_COUNTRIES, size),
+                "Latitude": rng.uniform(-60, 70, size).round(3),
+                "Longitude": rng.uniform(-180, 180, size).round(3),
+                "start_date": _dates(rng, size),
+                "Total Deaths": deaths,
+                "No Affected": rng.integers(0, 1_000_000, size),
+            },
+        )
+        chunk["end_date"] = chunk["start_date"]
+        return chunk.reindex(columns=DISASTER_COLUMNS)
+
+    return _write_chunks(file_path, rows, make_chunk, rng, chunksize)
+
+
+# Rows are consecutive months of every country up to the last synthetic
+# year, as in the combined Berkeley Earth file
+def generate_Temperature(file_path, rows, rng, chunksize=BENCHMARK_CHUNK_SIZE):
+    countries = SPECIFIED_COUNTRIES + ["WORLD"]
+    columns = [
+        "Year",
+        "Month",
+        "Monthly Anomaly",
+        "Monthly Uncertainty",
+        "Annual Anomaly",
+        "Annual Uncertainty",
+        "Five-year Anomaly",
+        "Five-year Uncertainty",
+        "Ten-year Anomaly",
+        "Ten-year Uncertainty",
+        "Twenty-year Anomaly",
+        "Twenty-year Uncertainty",
+        "Country",
+    ]
+    months_per_country = -(-rows // len(countries))
+
+    def make_chunk(rng, size, offset):
+        index = np.arange(offset, offset + size)
+        # Months counted back from December of the last synthetic year
+        month = months_per_country - 1 - index % months_per_country
+        last = SYNTHETIC_YEARS[-1] * 12 + 11
+        chunk = pd.DataFrame(
+            rng.normal(0, 0.5, (size, len(columns) - 3)).round(3),
+            columns=columns[2:-1],
+        )
+        chunk.insert(0, "Year", (last - month) // 12)
+        chunk.insert(1, "Month", (last - month) % 12 + 1)
+        chunk["Country"] = np.array(countries)[index // months_per_country]
+        return chunk
+
+    return _write_chunks(file_path, rows, make_chunk, rng, chunksize)
+
+
+# Raw file and generator of every pipeline input
+GENERATORS = {
+    "Carbon": ("Carbon.csv", generate_Carbon),
+    "Reddit": ("Reddit.csv", generate_Reddit),
+    "Disaster": ("Disasters.csv", generate_Disaster),
+    "Temperature": ("Anomaly_Temp.csv", generate_Temperature),
+}
+
+
+# Write the synthetic raw files to `path`, with rows given per dataset as
+# {name: rows}. Each dataset has its own seed spawned from `seed`.
+def generate_datasets(path, rows, seed=BENCHMARK_SEED, chunksize=BENCHMARK_CHUNK_SIZE):
+    os.makedirs(path, exist_ok=True)
+    seeds = np.random.SeedSequence(seed).spawn(len(GENERATORS))
+    for (name, (file_name, generate)), dataset_seed in zip(GENERATORS.items(), seeds):
+        if rows.get(name):
+            generate(
+                os.path.join(path, file_name),
+                rows[name],
+                np.random.default_rng(dataset_seed),
+                chunksize,
+            )
+
+
+def _benchmark_pipeline(path):
+    # Score every comment, as a first run would
+    cache = os.path.join(path, SENTIMENT_CACHE_NAME)
+    if os.path.exists(cache):
+        os.remove(cache)
+    for name in PIPELINE_STAGES:
+        with profile_stage(f"stage {name}"):
+            run_stage(name, path, force=True)
+
+
+def _benchmark_analysis(path):
+    analysis = Analysis(path)
+    disaster, carbon, temperature = analysis.prepare_data_for_analysis()
+    analysis.perform_monthly_regression_analysis(carbon, temperature)
+    analysis.perform_disaster_co2_regression_analysis(disaster, carbon)
+    analysis.perform_multiple_regression_analysis(disaster, carbon, temperature)
+    analysis.perform_resampling_inference(n_replicates=200)
+
+
+def _benchmark_plots(path):
+    cube = load_dataset("Cube", path)
+    for year in YEARS:
+        temperature = load_year_slice("Temperature", year, path)
+        plot_monthly_temperature_anomalies(year, temperature, save=False)
+        plot_monthly_carbon_emissions(year, cube, save=False)
+        plot_disaster_frequency(year, cube, save=False)
+        plot_sentiment_disaster_comparison(year, cube, save=False)
+        plt.close("all")
+
+
+# Benchmarked groups of stages, run in this order on the synthetic data
+BENCHMARKS = {
+    "pipeline": _benchmark_pipeline,
+    "analysis": _benchmark_analysis,
+    "plots": _benchmark_plots,
+}
+
+
+# Run the benchmarks and return the profile records of every stage they ran
+def run_benchmarks(path, benchmarks=BENCHMARKS, memory=True):
+    enable(memory)
+    clear()
+    clear_dataset_cache()
+    for name in benchmarks:
+        with profile_stage(f"benchmark {name}"):
+            BENCHMARKS[name](path)
+    return profile_records()
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Store a run as JSON in the results folder, with what is needed to compare it
+def save_results(records, rows, results_dir=os.path.join(BENCHMARK_PATH, "results")):
+    os.makedirs(results_dir, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    file_path = os.path.join(results_dir, f"{stamp}.json")
+    run = {
+        "metadata": {
+            "time": stamp,
+            "commit": _git_commit(),
+            "rows": rows,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "records": json.loads(records.to_json(orient="records", date_format="iso")),
+    }
+    with open(file_path, "w") as file:
+        json.dump(run, file, indent=2)
+    return file_path
+
+
+def load_results(file_path):
+    with open(file_path) as file:
+        run = json.load(file)
+    return run["metadata"], pd.DataFrame(run["records"])
+
+
+# Wall time, CPU time and peak memory of every stage in two stored runs,
+# with the ratio of the current run over the baseline
+def compare_results(baseline_path, current_path):
+    columns = ["Wall Seconds", "CPU Seconds", "Peak MB"]
+    baseline = profile_summary(load_results(baseline_path)[1])[columns]
+    current = profile_summary(load_results(current_path)[1])[columns]
+    comparison = baseline.join(
+        current, how="outer", lsuffix=" Baseline", rsuffix=" Current"
+    )
+    for column in columns:
+        comparison[f"{column} Ratio"] = (
+            comparison[f"{column} Current"] / comparison[f"{column} Baseline"]
+        )
+    return comparison.sort_values("Wall Seconds Current", ascending=False).round(3)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline")
+    parser.add_argument(
+        "--rows",
+        type=float,
+        default=BENCHMARK_ROWS,
+        help="rows of every synthetic dataset, e.g. 1e6",
+    )
+    for name in GENERATORS:
+        parser.add_argument(
+            f"--{name.lower()}-rows",
+            type=float,
+            help=f"rows of the synthetic {name} data, overrides --rows",
+        )
+    parser.add_argument(
+        "--benchmarks",
+        nargs="+",
+        choices=list(BENCHMARKS),
+        default=list(BENCHMARKS),
+        help="benchmarks to run",
+    )
+    parser.add_argument(
+        "--reuse-data",
+        action="store_true",
+        help="benchmark the already generated data",
+    )
+    parser.add_argument(
+        "--no-memory",
+        action="store_true",
+        help="do not trace memory, which slows Python code down",
+    )
+    parser.add_argument("--compare", help="stored run to compare this run with")
+    args = parser.parse_args()
+
+    data_path = os.path.join(BENCHMARK_PATH, "data")
+    rows = {
+        name: int(getattr(args, f"{name.lower()}_rows") or args.rows)
+        for name in GENERATORS
+    }
+    if not args.reuse_data:
+        if os.path.exists(data_path):
+            shutil.rmtree(data_path)
+        generate_datasets(data_path, rows)
+
+    records = run_benchmarks(data_path, args.benchmarks, memory=not args.no_memory)
+    print(profile_summary(records).to_string())
+    results_path = save_results(records, rows)
+    print(f"Results written to {results_path}")
+    if args.compare:
+        print(compare_results(args.compare, results_path).to_string())
@@ -14,8 +14,184 @@ SPECIFIED_COUNTRIES = [
     "Japan",
     "Brazil",
 ]
+# Labels of the aggregate rows kept next to the specified countries
+REST_OF_WORLD = "ROW"
+WORLD = "WORLD"
+
+# Time window of the whole pipeline, both years included
+START_YEAR = 2019
+END_YEAR = 2020
+YEARS = list(range(START_YEAR, END_YEAR + 1))
+
 # path of the data
 DATA_PATH = "data"
 
+# Do not access the web, use the already downloaded files in DATA_PATH
+OFFLINE = False
+
+# Downloads: concurrent requests, retries per request and timeout in seconds
+DOWNLOAD_WORKERS = 8
+DOWNLOAD_RETRIES = 5
+DOWNLOAD_TIMEOUT = 60
+
+# Record the time, CPU and peak memory of every pipeline stage (profiling.py)
+PROFILING = False
+
+# Benchmark suite (benchmark.py): folder of the synthetic data and stored
+# results, default rows per synthetic dataset, rows written at a time and seed
+BENCHMARK_PATH = "benchmarks"
+BENCHMARK_ROWS = 100_000
+BENCHMARK_CHUNK_SIZE = 1_000_000
+BENCHMARK_SEED = 2023
+
+# Embedded SQL database of the processed data (database.py), stored in
+# DATA_PATH as DATABASE_NAME-<version>.duckdb or .sqlite (one file per
+# version of the data), and the backend answering the Analysis queries:
+# "pandas" (the cube frame) or "sql" (the database)
+DATABASE_NAME = "climate"
+ANALYSIS_BACKEND = "pandas"
+
+# Rows of the Carbon Monitor feed processed at a time
+CARBON_CHUNK_SIZE = 500_000
+
+# Resampling inference: replicates per regression, seed, worker processes
+# (None uses every core) and replicates fitted per task
+RESAMPLING_REPLICATES = 2000
+RESAMPLING_SEED = 2023
+RESAMPLING_WORKERS = None
+RESAMPLING_BATCH_SIZE = 250
+
+# Vendored world country geometry in DATA_PATH, and the tolerance in degrees
+# its outlines are simplified to for display (0 keeps them as they are)
+WORLD_GEOMETRY_NAME = "world_geometry.parquet"
+WORLD_GEOMETRY_TOLERANCE = 0.05
+
+# Folder in DATA_PATH of the per-country Berkeley Earth arrays indexed by
+# (year, month), memory-mapped by the Temperature processing
+TEMPERATURE_STORE_DIR = "Temperature_Store"
+
 # path of the images
 IMAGES_PATH = "images"
+
+# Rendered dashboard plots, evicted beyond the size limit in bytes
+RENDER_CACHE_PATH = "images/cache"
+RENDER_CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+# Dashboard rendering off the event loop: "process" or "thread" pool, number
+# of plots rendered at a time, and whether to render the other tabs of the
+# selected year in the background
+RENDER_POOL = "process"
+RENDER_WORKERS = 2
+DASHBOARD_PREFETCH = True
+
+# Sentiment scoring throughput: worker processes (None uses every core) and
+# number of unique comments sent to a worker at a time
+SENTIMENT_WORKERS = None
+SENTIMENT_CHUNK_SIZE = 1000
+
+# Keep the comment text in the processed Reddit comments once scored
+KEEP_REDDIT_TEXT = True
+
+# On-disk sentiment cache kept in the data folder and its size bound
+SENTIMENT_CACHE_NAME = "sentiment_cache.sqlite"
+SENTIMENT_CACHE_MAX_ENTRIES = 5_000_000
+
+# Rows of the raw Reddit comments read at a time by the word counts
+REDDIT_CHUNK_SIZE = 200_000
+
+# Word cloud: comments kept if they mention one of the keywords, and words
+# left out on top of the WordCloud stopwords
+WORD_CLOUD_KEYWORDS = [
+    "climate",
+    "global warming",
+    "emission",
+    "carbon",
+    "greenhouse",
+    "environment",
+    "sustainability",
+    "pollution",
+    "renewable",
+    "ecology",
+    "conservation",
+    "biodiversity",
+    "fossil fuels",
+    "deforestation",
+    "recycling",
+    "solar",
+    "wind energy",
+    "eco-friendly",
+]
+WORD_CLOUD_STOPWORDS = [
+    "will", "one", "now", "use", "also", "like", "say", "make", "https", "due",
+    "get", "go", "going", "know", "see", "want", "think", "take", "need", "look",
+]
+
+# Keywords defining each Reddit post topic. Topics are matched in this order,
+# so the first topic with a keyword in the title wins.
+TOPIC_KEYWORDS = {
+    "Seriousness of gas emissions": ["emission", "gas", "CO2", "carbon", "methane"],
+    "Importance of human intervention": [
+        "human intervention",
+        "climate action",
+        "reduce emissions",
+        "environmental policy",
+    ],
+    "Global stance": [
+        "global",
+        "international",
+        "world",
+        "countries",
+        "UN",
+        "Paris Agreement",
+    ],
+    "Significance of pollution awareness events": [
+        "event",
+        "awareness",
+        "Earth Day",
+        "campaign",
+        "environmental day",
+    ],
+    "Weather extremes": [
+        "extreme weather",
+        "heatwave",
+        "flood",
+        "drought",
+        "hurricane",
+        "storm",
+    ],
+    "Impact of resource overconsumption": [
+        "overconsumption",
+        "resource depletion",
+        "overuse",
+        "waste",
+        "consumption",
+    ],
+    "Donald Trump versus science": [
+        "Trump",
+        "Donald Trump",
+        "administration",
+        "climate denial",
+    ],
+    "Ideological positions on global warming": [
+        "ideology",
+        "belief",
+        "skeptic",
+        "denier",
+        "activist",
+        "environmentalist",
+    ],
+    "Politics": [
+        "politics",
+        "policy",
+        "government",
+        "regulation",
+        "law",
+        "legislation",
+    ],
+    "Undefined": [],
+}
+
+# JSON file {topic: [keywords]} used instead of TOPIC_KEYWORDS when it exists.
+# Every process (pipeline, analysis, dashboard) reads it, so they all agree
+# on the topics the processed Reddit posts were classified with.
+TOPIC_CONFIG_PATH = "topics.json"
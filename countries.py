@@ -0,0 +1,99 @@
+"""This file contains the canonical country index shared by every dataset."""
+
+import re
+import pandas as pd
+from const import REST_OF_WORLD, SPECIFIED_COUNTRIES, WORLD
+
+# Canonical countries by ISO 3166 alpha-3 code (WLD and ROW for the
+# aggregates): the name used across the processed datasets and the other
+# spellings found in the raw sources (EM-DAT, Carbon Monitor, Berkeley Earth,
+# Natural Earth). Spellings are matched ignoring case, punctuation and a
+# trailing "(the)", so only genuinely different names need an alias.
+COUNTRY_INDEX = {
+    "CHN": ("China", ["People's Republic of China"]),
+    "USA": ("United States", ["United States of America", "US", "USA"]),
+    "IND": ("India", []),
+    "GBR": (
+        "United Kingdom",
+        ["United Kingdom of Great Britain and Northern Ireland", "UK"],
+    ),
+    "FRA": ("France", []),
+    "DEU": ("Germany", []),
+    "ITA": ("Italy", []),
+    "ESP": ("Spain", []),
+    "RUS": ("Russia", ["Russian Federation"]),
+    "JPN": ("Japan", []),
+    "BRA": ("Brazil", []),
+    "ROW": (REST_OF_WORLD, ["Rest of the World", "Rest of World"]),
+    "WLD": (WORLD, ["World", "Global"]),
+}
+
+COUNTRY_NAMES = {code: name for code, (name, _) in COUNTRY_INDEX.items()}
+
+# Every dataset stores its Country column with this dtype, so the columns of
+# different datasets share their categories and compare as integer codes
+COUNTRY_DTYPE = pd.CategoricalDtype(list(COUNTRY_NAMES.values()))
+
+_missing = set(SPECIFIED_COUNTRIES) - set(COUNTRY_NAMES.values())
+if _missing:
+    raise ValueError(f"Specified countries missing from COUNTRY_INDEX: {_missing}")
+
+
+# Matching key of a country spelling, e.g. "Russian Federation (the)" and
+# "russian federation" both give "russianfederation"
+def _alias_key(name):
+    name = re.sub(r"\s*\(the\)\s*$", "", str(name).casefold())
+    return re.sub(r"[^0-9a-z]", "", name)
+
+
+# Matching key of every spelling in an index (the name, ISO3 code and
+# aliases of each country) to its ISO3 code
+def country_aliases(index=COUNTRY_INDEX):
+    return {
+        _alias_key(spelling): code
+        for code, (name, aliases) in index.items()
+        for spelling in [name, code] + aliases
+    }
+
+
+COUNTRY_ALIASES = country_aliases()
+
+
+# Look up each distinct spelling once and broadcast the result to the rows.
+# Missing names are looked up too, so they also take the default.
+def _lookup(names, mapping, aliases=COUNTRY_ALIASES):
+    names = pd.Series(names)
+    codes, uniques = pd.factorize(names, use_na_sentinel=False)
+    values = [mapping.get(aliases.get(_alias_key(u))) for u in uniques]
+    return names, codes, values
+
+
+# ISO3 code of every country name, NaN for countries outside the index
+def country_code(names):
+    names, codes, values = _lookup(names, {code: code for code in COUNTRY_INDEX})
+    categories = pd.CategoricalDtype(list(COUNTRY_INDEX))
+    result = pd.Categorical(values, dtype=categories).take(codes, allow_fill=True)
+    return pd.Series(result, index=names.index, name="Country Code")
+
+
+# Canonical name of every country name as a COUNTRY_DTYPE categorical.
+# Countries outside the index become `default` (e.g. REST_OF_WORLD), or NaN.
+# Stages pass their `country_index` param, so editing the index changes
+# their fingerprint.
+def normalize_country(names, default=None, index=COUNTRY_INDEX):
+    if index is COUNTRY_INDEX:
+        aliases, dtype = COUNTRY_ALIASES, COUNTRY_DTYPE
+    else:
+        aliases = country_aliases(index)
+        dtype = pd.CategoricalDtype([name for name, _ in index.values()])
+    canonical = {code: name for code, (name, _) in index.items()}
+    names, codes, values = _lookup(names, canonical, aliases)
+    if default is not None:
+        values = [default if value is None else value for value in values]
+    result = pd.Categorical(values, dtype=dtype).take(codes, allow_fill=True)
+    return pd.Series(result, index=names.index, name=names.name)
+
+
+# Code deciding the canonical country names, part of the fingerprint of the
+# stages normalizing countries
+COUNTRY_CODE = [normalize_country, country_aliases, _lookup, _alias_key]
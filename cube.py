@@ -0,0 +1,163 @@
+"""This file contains the monthly aggregate cube shared by analysis and plotting."""
+
+import pandas as pd
+from const import REST_OF_WORLD, SPECIFIED_COUNTRIES, WORLD
+
+# Label of the dimension and category of datasets aggregated as a whole
+ALL = "All"
+
+# What the cube aggregates for each processed dataset: the dimension columns
+# it is broken down by and the measures summed over each cell
+CUBE_SPEC = {
+    "Carbon": {"dimensions": ["Sector"], "measures": ["Value"]},
+    "Disaster": {"dimensions": ["Disaster Type"], "measures": ["Total Deaths"]},
+    "Reddit": {
+        "dimensions": ["Comment_Sentiment", "Topic"],
+        "measures": ["Comment_Polarity"],
+    },
+    "Temperature": {
+        "dimensions": [],
+        "measures": ["Monthly Anomaly", "Monthly Uncertainty"],
+    },
+}
+
+CUBE_COLUMNS = [
+    "Dataset",
+    "Year",
+    "Month",
+    "Country",
+    "Dimension",
+    "Category",
+    "Measure",
+    "Count",
+    "Sum",
+]
+
+
+# Grouping sets (by + specified country), (by + rest of the world) and (by)
+# over the rows of a dataset in one pass: rows are grouped once on a country
+# key mapping every unspecified country to `rest_of_world`, and the `world`
+# totals are summed from that small grouped frame. With `keep_rows` the rows
+# of the specified countries are kept as they are (e.g. the Disaster events)
+# rather than summed. Datasets without a country (Reddit) only get `world`
+# rows. Returns the rows with the `by`, `country` and `values` columns.
+def rollup_countries(
+    df,
+    by,
+    values,
+    countries=SPECIFIED_COUNTRIES,
+    rest_of_world=REST_OF_WORLD,
+    world=WORLD,
+    country="Country",
+    keep_rows=False,
+):
+    by = list(by)
+    values = list(values)
+    if country not in df:
+        world_grouped = df.groupby(by, observed=True)[values].sum().reset_index()
+        world_grouped[country] = world
+        return world_grouped[by + [country] + values]
+
+    specified = df[country].isin(countries)
+    key = df[country]
+    if isinstance(key.dtype, pd.CategoricalDtype) and (
+        rest_of_world not in key.cat.categories
+    ):
+        key = key.cat.add_categories([rest_of_world])
+    key = key.where(specified, rest_of_world)
+    grouped = df.groupby(by + [key], observed=True)[values].sum().reset_index()
+    world_grouped = grouped.groupby(by, observed=True)[values].sum().reset_index()
+    world_grouped[country] = world
+
+    if keep_rows:
+        parts = [df.loc[specified, by + [country] + values]]
+        grouped = grouped[grouped[country] == rest_of_world]
+    else:
+        parts = []
+    parts += [grouped, world_grouped[by + [country] + values]]
+    return pd.concat(parts, ignore_index=True)
+
+
+# One long frame with a row per Dataset x Year x Month x Country x
+# Dimension/Category x Measure, holding the number of rows and the sum of the
+# measure. Datasets without a country (Reddit) are filed under WORLD.
+def build_monthly_cube(frames, spec=CUBE_SPEC):
+    parts = []
+    for dataset, df in frames.items():
+        dataset_spec = spec[dataset]
+        df = df.copy(deep=False)
+        if "Country" not in df:
+            df["Country"] = WORLD
+        dimensions = dataset_spec["dimensions"] or [None]
+        for dimension in dimensions:
+            if dimension is None:
+                df["_category"] = ALL
+            else:
+                df["_category"] = df[dimension].astype("object")
+            for measure in dataset_spec["measures"]:
+                # e.g. Reddit data processed before the polarity was kept
+                if measure not in df:
+                    df[measure] = float("nan")
+                grouped = (
+                    df.groupby(
+                        ["Year", "Month", "Country", "_category"], observed=True
+                    )[measure]
+                    .agg(["size", "sum"])
+                    .reset_index()
+                    .rename(
+                        columns={"_category": "Category", "size": "Count", "sum": "Sum"}
+                    )
+                )
+                grouped["Dataset"] = dataset
+                grouped["Dimension"] = dimension or ALL
+                grouped["Measure"] = measure
+                parts.append(grouped)
+
+    cube = pd.concat(parts, ignore_index=True)
+    cube["Country"] = cube["Country"].astype("object")
+    return cube[CUBE_COLUMNS]
+
+
+# Aggregate the cube cells of one dataset over everything but the `by` columns.
+# Filters select a measure, a dimension and the years/countries to keep (or
+# drop). Returns the `by` columns with the summed Count and Sum.
+def query_cube(
+    cube,
+    dataset,
+    measure=None,
+    dimension=None,
+    years=None,
+    countries=None,
+    exclude_countries=None,
+    by=("Year", "Month"),
+):
+    # A CubeDatabase (database.py) answers the same query in SQL
+    if not isinstance(cube, pd.DataFrame):
+        return cube.query_cube(
+            dataset, measure, dimension, years, countries, exclude_countries, by
+        )
+
+    spec = CUBE_SPEC[dataset]
+    if measure is None:
+        measure = spec["measures"][0]
+    if dimension is None:
+        dimension = spec["dimensions"][0] if spec["dimensions"] else ALL
+
+    mask = (
+        (cube["Dataset"] == dataset)
+        & (cube["Measure"] == measure)
+        & (cube["Dimension"] == dimension)
+    )
+    if years is not None:
+        mask &= cube["Year"].isin(years)
+    if countries is not None:
+        mask &= cube["Country"].isin(countries)
+    if exclude_countries is not None:
+        mask &= ~cube["Country"].isin(exclude_countries)
+
+    return (
+        cube[mask]
+        .groupby(list(by), observed=True)[["Count", "Sum"]]
+        .sum()
+        .reset_index()
+    )
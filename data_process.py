@@ -1,121 +1,701 @@
+import argparse
 import os
+import shutil
+from contextlib import contextmanager
+from functools import lru_cache
 import pandas as pd
-from const import DATA_PATH, SPECIFIED_COUNTRIES
-from sentiment_topic import analyze_sentiment, analyze_title_topics
+import requests
+from pandas.tseries.api import guess_datetime_format
+from const import (
+    CARBON_CHUNK_SIZE,
+    DATA_PATH,
+    DOWNLOAD_TIMEOUT,
+    KEEP_REDDIT_TEXT,
+    REDDIT_CHUNK_SIZE,
+    REST_OF_WORLD,
+    SENTIMENT_CACHE_NAME,
+    SENTIMENT_CHUNK_SIZE,
+    SENTIMENT_WORKERS,
+    SPECIFIED_COUNTRIES,
+    TOPIC_CONFIG_PATH,
+    WORD_CLOUD_KEYWORDS,
+    WORD_CLOUD_STOPWORDS,
+    WORLD,
+    YEARS,
+)
+from profiling import (
+    annotate_stage,
+    enable as enable_profiling,
+    profile_stage,
+    profiled,
+    report_profile,
+)
+from fingerprint import (
+    code_fingerprint,
+    file_fingerprint,
+    read_manifest,
+    same_content,
+    value_fingerprint,
+    write_manifest,
+)
+from sentiment_cache import SentimentCache
+from countries import COUNTRY_CODE, COUNTRY_INDEX, normalize_country
+from cube import CUBE_SPEC, build_monthly_cube, rollup_countries
+from schema import SCHEMAS, apply_schema
+from temperature_store import (
+    TEMPERATURE_COLUMNS,
+    TemperatureStore,
+    load_temperature_store,
+    write_temperature_store,
+)
+from storage import (
+    csv_path,
+    dataset_exists,
+    parquet_path,
+    read_dataset,
+    write_dataset,
+)
+from sentiment_topic import (
+    analyze_sentiment_batch,
+    classify_title_topics,
+    compile_topic_patterns,
+    configured_topic_keywords,
+    label_polarity,
+    load_topic_keywords,
+    score_polarity,
+)
+from word_frequency import (
+    compile_keyword_matcher,
+    count_tokens,
+    word_frequencies,
+)
 
-def process_Disaster_data(path, specific_countries, rest_of_world, world):
+@profiled
+def process_Disaster_data(
+    path,
+    specific_countries,
+    rest_of_world,
+    world,
+    years=YEARS,
+    country_index=COUNTRY_INDEX,
+):
     df_Disaster = pd.read_csv(os.path.join(path, "Disasters.csv"))
     df_Disaster["start_date"] = pd.to_datetime(
         df_Disaster["start_date"], errors="coerce"
     )
     df_Disaster["Year"] = df_Disaster["start_date"].dt.year
     df_Disaster["Month"] = df_Disaster["start_date"].dt.month
-    
-    df_Disaster["Country"] = df_Disaster["Country"].replace({
-        "Russian Federation (the)": "Russian",
-        "United States of America (the)": "United States"
-    })
+
+    # Canonical country names, e.g. "Russian Federation (the)" -> "Russia"
+    df_Disaster["Country"] = normalize_country(
+        df_Disaster["Country"], index=country_index
+    )
 
     df_Disaster = df_Disaster[
         ["Disaster Type", "Country", "Year", "Month", "Total Deaths"]
     ]
-    df_Disaster = df_Disaster[df_Disaster["Year"].isin([2019, 2020])]
-    df_Disaster.fillna(0, inplace=True)
+    df_Disaster = df_Disaster[df_Disaster["Year"].isin(years)]
+    df_Disaster = df_Disaster.fillna({"Total Deaths": 0})
 
-    # Grouping all data by 'Year', 'Month', and 'Disaster Type' and summing 'Total Deaths' for "WORLD"
-    df_world_grouped = (
-        df_Disaster.groupby(["Year", "Month", "Disaster Type"])
-        .agg({"Total Deaths": "sum"})
-        .reset_index()
+    # The events of the specified countries, with the 'Rest of the World'
+    # and "WORLD" deaths summed by 'Year', 'Month' and 'Disaster Type'
+    df_combined = rollup_countries(
+        df_Disaster,
+        ["Year", "Month", "Disaster Type"],
+        ["Total Deaths"],
+        specific_countries,
+        rest_of_world,
+        world,
+        keep_rows=True,
     )
-    df_world_grouped["Country"] = world
 
-    # Separating specified countries and 'Rest of the World'
-    df_specific = df_Disaster[df_Disaster["Country"].isin(specific_countries)]
-    df_rest = df_Disaster[~df_Disaster["Country"].isin(specific_countries)]
-    df_rest["Country"] = rest_of_world
-
-    # Grouping 'Rest of the World' data by 'Year' and 'Month' and summing 'Total Deaths'
-    df_rest_grouped = (
-        df_rest.groupby(["Year", "Month", "Disaster Type"])
-        .agg({"Total Deaths": "sum"})
-        .reset_index()
-    )
-    df_rest_grouped["Country"] = rest_of_world
+    return apply_schema(df_combined, "Disaster")
 
-    # Combining the specific countries data with the 'Rest of the World' data
-    df_combined = pd.concat(
-        [df_specific, df_rest_grouped, df_world_grouped], ignore_index=True
+# Filter, clean and type one chunk of the Carbon Monitor feed
+def _process_Carbon_chunk(df_Carbon, date_format, years, countries, country_index):
+    df_Carbon["date"] = pd.to_datetime(
+        df_Carbon["date"], format=date_format, errors="coerce"
     )
-
-    return df_combined
-
-def process_Carbon_data(path):
-    df_Carbon = pd.read_csv(os.path.join(path, "Carbon.csv"))
-    df_Carbon["date"] = pd.to_datetime(df_Carbon["date"], errors="coerce")
     df_Carbon["Year"] = df_Carbon["date"].dt.year
     df_Carbon["Month"] = df_Carbon["date"].dt.month
+    df_Carbon["country"] = normalize_country(df_Carbon["country"], index=country_index)
     df_Carbon = df_Carbon[["country", "Year", "Month", "sector", "value"]]
-    df_Carbon = df_Carbon[df_Carbon["Year"].isin([2019, 2020])]
-    df_Carbon.fillna(0, inplace=True)
-    df_Carbon.rename(
-        columns={"country": "Country", "sector": "Sector", "value": "Value"},
-        inplace=True,
+    df_Carbon = df_Carbon[
+        df_Carbon["Year"].isin(years) & df_Carbon["country"].isin(countries)
+    ]
+    df_Carbon = df_Carbon.fillna({"sector": 0, "value": 0})
+    df_Carbon = df_Carbon.rename(
+        columns={"country": "Country", "sector": "Sector", "value": "Value"}
     )
-    df_Carbon = df_Carbon[df_Carbon["Country"] != "EU27 & UK"]
     df_Carbon["Value"] = df_Carbon["Value"].round(3)
 
-    return df_Carbon
+    return apply_schema(df_Carbon, "Carbon")
+
+# A file path as is, or the body of a URL streamed off the socket as it is
+# parsed (pandas would read a URL into memory whole before parsing it)
+@contextmanager
+def _open_source(source):
+    if not str(source).startswith(("http://", "https://")):
+        yield source
+        return
+    with requests.get(source, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+        response.raise_for_status()
+        # Undo any gzip/deflate transfer encoding while streaming
+        response.raw.decode_content = True
+        yield response.raw
 
-def process_Reddit_data(path):
-    df_Reddit = pd.read_csv(os.path.join(path, "Reddit.csv"))
-    df_Reddit["post_created_time"] = pd.to_datetime(
-        df_Reddit["post_created_time"], errors="coerce"
+# The Carbon feed is read in chunks from disk, or from source (a file path or
+# URL) if given, so peak memory is bounded by the chunk size rather than the
+# file size. Each chunk is filtered to the years and countries (plus the ROW
+# and WORLD aggregates) before it is kept.
+@profiled
+def process_Carbon_data(
+    path,
+    years=YEARS,
+    countries=SPECIFIED_COUNTRIES,
+    source=None,
+    chunksize=CARBON_CHUNK_SIZE,
+    country_index=COUNTRY_INDEX,
+):
+    if source is None:
+        source = os.path.join(path, "Carbon.csv")
+
+    countries = list(countries) + [REST_OF_WORLD, WORLD]
+    date_format = None
+    processed = []
+    with _open_source(source) as handle:
+        chunks = pd.read_csv(
+            handle,
+            usecols=["country", "date", "sector", "value"],
+            chunksize=chunksize,
+        )
+        for chunk in chunks:
+            # Infer the date format once, like parsing the whole file would
+            if date_format is None and chunk["date"].notna().any():
+                first_date = chunk["date"].dropna().iloc[0]
+                date_format = guess_datetime_format(str(first_date))
+            df_chunk = _process_Carbon_chunk(
+                chunk, date_format, years, countries, country_index
+            )
+            # Chunks with no row left are not concatenated (pandas warns on
+            # them), one is kept for its dtypes in case every chunk is empty
+            if len(df_chunk):
+                processed.append(df_chunk)
+            else:
+                empty = df_chunk
+
+    df_Carbon = pd.concat(processed or [empty], ignore_index=True)
+    return apply_schema(df_Carbon, "Carbon")
+
+# Reddit.csv has a row per comment, repeating the post on each of them.
+# Posts are kept once, numbered by an integer Post Key, and their title topic
+# is classified once per post.
+@profiled
+def process_RedditPosts_data(
+    path, years=YEARS, topic_keywords=None, chunksize=REDDIT_CHUNK_SIZE
+):
+    chunks = pd.read_csv(
+        os.path.join(path, "Reddit.csv"),
+        usecols=["post_id", "post_created_time", "post_title", "post_self_text"],
+        chunksize=chunksize,
     )
-    df_Reddit["Year"] = df_Reddit["post_created_time"].dt.year
-    df_Reddit["Month"] = df_Reddit["post_created_time"].dt.month
-    df_Reddit = df_Reddit[
-        ["post_self_text", "Year", "Month", "post_title", "self_text"]
-    ]
-    df_Reddit = df_Reddit[df_Reddit["Year"].isin([2019, 2020])]
-    df_Reddit.rename(
+    df_Posts = pd.concat(
+        [chunk.drop_duplicates("post_id") for chunk in chunks], ignore_index=True
+    ).drop_duplicates("post_id", ignore_index=True)
+
+    df_Posts["post_created_time"] = pd.to_datetime(
+        df_Posts["post_created_time"], errors="coerce"
+    )
+    df_Posts["Year"] = df_Posts["post_created_time"].dt.year
+    df_Posts["Month"] = df_Posts["post_created_time"].dt.month
+    df_Posts = df_Posts[df_Posts["Year"].isin(years)].reset_index(drop=True)
+    df_Posts = df_Posts.rename(
         columns={
+            "post_id": "Post ID",
             "post_self_text": "Post",
             "post_title": "Title",
-            "self_text": "Comment",
-        },
-        inplace=True,
+        }
     )
+    df_Posts["Post Key"] = range(len(df_Posts))
 
-    # Apply sentiment analysis on the 'Comment' column
-    df_Reddit["Comment_Sentiment"] = df_Reddit["Comment"].apply(analyze_sentiment)
     # Apply topics in post titles and add a Topic column
-    df_Reddit["Topic"] = df_Reddit["Title"].apply(analyze_title_topics)
+    df_Posts["Topic"] = classify_title_topics(
+        df_Posts["Title"], compile_topic_patterns(topic_keywords)
+    )
 
-    return df_Reddit
+    return apply_schema(df_Posts, "RedditPosts")
 
-def process_Temperature_data(path):
-    df_Temperature = pd.read_csv(os.path.join(path, "Anomaly_Temp.csv"))
-    df_Temperature = df_Temperature[
-        ["Year", "Month", "Monthly Anomaly", "Monthly Uncertainty", "Country"]
-    ]
-    df_Temperature = df_Temperature[df_Temperature["Year"].isin([2019, 2020])]
+# Comments of the processed posts, linked to them by Post Key, with their
+# sentiment
+@profiled
+def process_Reddit_data(
+    path,
+    workers=SENTIMENT_WORKERS,
+    chunk_size=SENTIMENT_CHUNK_SIZE,
+    use_cache=True,
+    keep_text=True,
+    chunksize=REDDIT_CHUNK_SIZE,
+):
+    df_Posts = run_stage("RedditPosts", path, columns=["Post ID", "Post Key"])
+    post_keys = pd.Series(
+        df_Posts["Post Key"].to_numpy(), index=df_Posts["Post ID"].to_numpy()
+    )
+    chunks = pd.read_csv(
+        os.path.join(path, "Reddit.csv"),
+        usecols=["post_id", "self_text"],
+        chunksize=chunksize,
+    )
+    # Comments of posts outside the years have no key and are dropped
+    df_Reddit = pd.concat(
+        [
+            pd.DataFrame(
+                {
+                    "Post Key": chunk["post_id"].map(post_keys),
+                    "Comment": chunk["self_text"],
+                }
+            ).dropna(subset=["Post Key"])
+            for chunk in chunks
+        ],
+        ignore_index=True,
+    )
+
+    # Apply sentiment analysis on the 'Comment' column
+    # Comments scored in previous runs are read back from the sentiment cache
+    if use_cache:
+        with SentimentCache(os.path.join(path, SENTIMENT_CACHE_NAME)) as cache:
+            sentiment = analyze_sentiment_batch(
+                df_Reddit["Comment"], workers, chunk_size, cache
+            )
+            stats = cache.stats()
+        annotate_stage(
+            {
+                "Cache Hits": stats["hits"],
+                "Cache Misses": stats["misses"],
+                "Cache Entries": stats["entries"],
+            }
+        )
+    else:
+        sentiment = analyze_sentiment_batch(
+            df_Reddit["Comment"], workers, chunk_size
+        )
+    df_Reddit["Comment_Sentiment"] = sentiment["Sentiment"]
+    df_Reddit["Comment_Polarity"] = sentiment["Polarity"]
+    # The comment text is only needed for scoring, the raw Reddit.csv still
+    # holds it for the word cloud
+    if not keep_text:
+        df_Reddit = df_Reddit.drop(columns=["Comment"])
 
-    return df_Temperature
+    return apply_schema(df_Reddit, "Reddit")
 
-def process_main():
-    df_Carbon = process_Carbon_data(DATA_PATH)
-    df_Reddit = process_Reddit_data(DATA_PATH)
-    df_Disaster = process_Disaster_data(DATA_PATH, SPECIFIED_COUNTRIES, "ROW", "WORLD")
-    df_Temperature = process_Temperature_data(DATA_PATH)
+# Comments with the year, month and topic of their post, joined on Post Key
+def join_Reddit_data(df_Reddit, df_Posts):
+    return df_Reddit.merge(
+        df_Posts[["Post Key", "Year", "Month", "Topic"]], on="Post Key"
+    )
 
-    # Saving the dataframes to new CSV files
-    df_Carbon.to_csv(os.path.join(DATA_PATH, "Processed_Carbon.csv"), index=False)
-    df_Reddit.to_csv(os.path.join(DATA_PATH, "Processed_Reddit.csv"), index=False)
-    df_Disaster.to_csv(os.path.join(DATA_PATH, "Processed_Disaster.csv"), index=False)
-    df_Temperature.to_csv(os.path.join(DATA_PATH, "Processed_Temperature.csv"), index=False)
+@profiled
+def process_Temperature_data(
+    path, years=YEARS, countries=SPECIFIED_COUNTRIES, country_index=COUNTRY_INDEX
+):
+    # The combined file is read in full once, after that the years are sliced
+    # from the memory-mapped per-country store
+    source = os.path.join(path, "Anomaly_Temp.csv")
+    store = load_temperature_store(path, source)
+    if store is None:
+        store = write_temperature_store(
+            pd.read_csv(source, usecols=TEMPERATURE_COLUMNS + ["Country"]),
+            path,
+            source,
+        )
+
+    store_countries = pd.Series(store.countries)
+    keep = normalize_country(store_countries, index=country_index).isin(
+        list(countries) + [WORLD]
+    )
+    df_Temperature = store.frame(store_countries[keep], years)
+    df_Temperature["Country"] = normalize_country(
+        df_Temperature["Country"], index=country_index
+    )
+
+    return apply_schema(df_Temperature, "Temperature")
+
+# Comments of the years, streamed from the raw Reddit.csv a chunk at a time.
+# Without the raw file the comments kept in the processed Reddit data are used.
+def _iter_Reddit_comments(path, years, chunksize):
+    source = os.path.join(path, "Reddit.csv")
+    if not os.path.exists(source):
+        # Already restricted to the comments of the posts of the years
+        yield run_stage("Reddit", path, columns=["Comment"])["Comment"]
+        return
+
+    chunks = pd.read_csv(
+        source, usecols=["post_created_time", "self_text"], chunksize=chunksize
+    )
+    date_format = None
+    for chunk in chunks:
+        created = chunk["post_created_time"]
+        if date_format is None and created.notna().any():
+            date_format = guess_datetime_format(str(created.dropna().iloc[0]))
+        years_of_rows = pd.to_datetime(
+            created, format=date_format, errors="coerce"
+        ).dt.year
+        yield chunk.loc[years_of_rows.isin(years), "self_text"]
+
+# Frequencies of the words of the climate related comments, for the word cloud
+@profiled
+def process_WordFrequency_data(
+    path,
+    years=YEARS,
+    keywords=WORD_CLOUD_KEYWORDS,
+    stopwords=WORD_CLOUD_STOPWORDS,
+    chunksize=REDDIT_CHUNK_SIZE,
+):
+    matcher = compile_keyword_matcher(keywords)
+    counts = None
+    for comments in _iter_Reddit_comments(path, years, chunksize):
+        counts = count_tokens(comments, matcher, counts)
+    return apply_schema(word_frequencies(counts or {}, stopwords), "WordFrequency")
+
+# Monthly aggregate cube of the other processed datasets
+@profiled
+def process_Cube_data(path, spec=CUBE_SPEC):
+    frames = {
+        name: run_stage(name, path) for name in spec if name != "Reddit"
+    }
+    if "Reddit" in spec:
+        frames["Reddit"] = join_Reddit_data(
+            run_stage("Reddit", path), run_stage("RedditPosts", path)
+        )
+    return apply_schema(build_monthly_cube(frames, spec), "Cube")
+
+# Bump to invalidate every processed output without touching the code
+PIPELINE_VERSION = 1
+
+# Pipeline stages: raw inputs, upstream stages, processed output (stored by
+# storage.py), producing function and the parameters passed to it. Inputs,
+# upstream outputs, parameters and code are fingerprinted.
+PIPELINE_STAGES = {
+    "Carbon": {
+        "inputs": ["Carbon.csv"],
+        "output": "Processed_Carbon",
+        "function": process_Carbon_data,
+        "params": {
+            "years": YEARS,
+            "countries": SPECIFIED_COUNTRIES,
+            "country_index": COUNTRY_INDEX,
+        },
+        "code": [
+            process_Carbon_data,
+            _process_Carbon_chunk,
+            *COUNTRY_CODE,
+            apply_schema,
+        ],
+    },
+    "RedditPosts": {
+        "inputs": ["Reddit.csv"],
+        "output": "Processed_Reddit_Posts",
+        "function": process_RedditPosts_data,
+        "params": {"years": YEARS, "topic_keywords": configured_topic_keywords()},
+        "code": [
+            process_RedditPosts_data,
+            classify_title_topics,
+            compile_topic_patterns,
+            apply_schema,
+        ],
+    },
+    "Reddit": {
+        "inputs": ["Reddit.csv"],
+        "depends": ["RedditPosts"],
+        "output": "Processed_Reddit",
+        "function": process_Reddit_data,
+        "params": {"keep_text": KEEP_REDDIT_TEXT},
+        "code": [
+            process_Reddit_data,
+            analyze_sentiment_batch,
+            score_polarity,
+            label_polarity,
+            apply_schema,
+        ],
+    },
+    "Disaster": {
+        "inputs": ["Disasters.csv"],
+        "output": "Processed_Disaster",
+        "function": process_Disaster_data,
+        "params": {
+            "specific_countries": SPECIFIED_COUNTRIES,
+            "rest_of_world": REST_OF_WORLD,
+            "world": WORLD,
+            "years": YEARS,
+            "country_index": COUNTRY_INDEX,
+        },
+        "code": [
+            process_Disaster_data,
+            *COUNTRY_CODE,
+            rollup_countries,
+            apply_schema,
+        ],
+    },
+    "Temperature": {
+        "inputs": ["Anomaly_Temp.csv"],
+        "output": "Processed_Temperature",
+        "function": process_Temperature_data,
+        "params": {
+            "years": YEARS,
+            "countries": SPECIFIED_COUNTRIES,
+            "country_index": COUNTRY_INDEX,
+        },
+        "code": [
+            process_Temperature_data,
+            *COUNTRY_CODE,
+            write_temperature_store,
+            TemperatureStore,
+            apply_schema,
+        ],
+    },
+    "WordFrequency": {
+        "inputs": ["Reddit.csv"],
+        "output": "Processed_WordFrequency",
+        "function": process_WordFrequency_data,
+        "params": {
+            "years": YEARS,
+            "keywords": WORD_CLOUD_KEYWORDS,
+            "stopwords": WORD_CLOUD_STOPWORDS,
+        },
+        "code": [
+            process_WordFrequency_data,
+            _iter_Reddit_comments,
+            count_tokens,
+            word_frequencies,
+            apply_schema,
+        ],
+    },
+    "Cube": {
+        "inputs": [],
+        "depends": ["Carbon", "RedditPosts", "Reddit", "Disaster", "Temperature"],
+        "output": "Processed_Cube",
+        "function": process_Cube_data,
+        "params": {"spec": CUBE_SPEC},
+        "code": [
+            process_Cube_data,
+            join_Reddit_data,
+            build_monthly_cube,
+            apply_schema,
+        ],
+    },
+}
+
+# Processed datasets read by each consumer of the pipeline
+STAGE_DEPENDENCIES = {
+    "Analysis": ["Cube"],
+    "plotting": ["WordFrequency", "Temperature", "Cube"],
+}
+
+def _get_stage(name):
+    if name not in PIPELINE_STAGES:
+        raise KeyError(
+            f"Unknown dataset {name!r}, expected one of {list(PIPELINE_STAGES)}"
+        )
+    return PIPELINE_STAGES[name]
+
+# Current fingerprint of a stage, reusing file hashes from the previous one
+def stage_fingerprint(name, path=DATA_PATH, previous=None):
+    stage = _get_stage(name)
+    previous_inputs = (previous or {}).get("inputs", {})
+    inputs = {}
+    for file_name in stage["inputs"]:
+        file_path = os.path.join(path, file_name)
+        if os.path.exists(file_path):
+            inputs[file_name] = file_fingerprint(
+                file_path, previous_inputs.get(file_name)
+            )
+        else:
+            inputs[file_name] = None
+    # Upstream stages are identified by their own recorded fingerprints
+    manifest = read_manifest(path)
+    depends = {
+        upstream: value_fingerprint(manifest.get(upstream))
+        for upstream in stage.get("depends", [])
+    }
+    return {
+        "inputs": inputs,
+        "depends": depends,
+        "params": value_fingerprint(stage["params"]),
+        "schema": value_fingerprint(SCHEMAS[name]),
+        "code": code_fingerprint(*stage["code"]),
+        "version": PIPELINE_VERSION,
+    }
+
+def _is_stale(name, path, previous, fingerprint):
+    if not dataset_exists(PIPELINE_STAGES[name]["output"], path):
+        return True
+    if any(value is None for value in fingerprint["inputs"].values()):
+        return False
+    return not same_content(previous, fingerprint)
+
+# A stage is stale unless its output exists and was built from the same
+# inputs, parameters and code. An output whose raw inputs are not available
+# (e.g. Reddit.csv, which is not shipped) is reused as is.
+def is_stage_stale(name, path=DATA_PATH, manifest=None):
+    if manifest is None:
+        manifest = read_manifest(path)
+    # A stage built on a stale upstream stage will be rebuilt as well
+    for upstream in _get_stage(name).get("depends", []):
+        if is_stage_stale(upstream, path, manifest):
+            return True
+    fingerprint = stage_fingerprint(name, path, manifest.get(name))
+    return _is_stale(name, path, manifest.get(name), fingerprint)
+
+# Processed datasets that must be rebuilt before a stage or consumer can run
+def stale_stages(target, path=DATA_PATH):
+    names = STAGE_DEPENDENCIES.get(target, [target])
+    manifest = read_manifest(path)
+    return [name for name in names if is_stage_stale(name, path, manifest)]
+
+# Return a processed dataset, rebuilding it only if its inputs changed.
+# Only the requested columns and years are read back from storage.
+def run_stage(
+    name, path=DATA_PATH, force=False, columns=None, years=None, export_csv=False
+):
+    stage = _get_stage(name)
+    # Bring upstream stages up to date first, their fingerprints are inputs
+    for upstream in stage.get("depends", []):
+        if is_stage_stale(upstream, path):
+            run_stage(upstream, path)
+    previous = read_manifest(path).get(name)
+    fingerprint = stage_fingerprint(name, path, previous)
+    if not force and not _is_stale(name, path, previous, fingerprint):
+        with profile_stage(f"read {stage['output']}") as record:
+            if export_csv and not os.path.exists(csv_path(stage["output"], path)):
+                df = read_dataset(stage["output"], path, dtypes=SCHEMAS[name])
+                write_dataset(df, stage["output"], path, export_csv)
+            df = read_dataset(stage["output"], path, columns, years, SCHEMAS[name])
+            record["Rows"] = len(df)
+        return df
+
+    df = stage["function"](path, **stage["params"])
+    df = write_dataset(df, stage["output"], path, export_csv)
+    if years is not None:
+        df = df[df["Year"].isin(years)].reset_index(drop=True)
+    if columns is not None:
+        df = df[columns]
+
+    # Re-read the manifest in case another stage was recorded meanwhile
+    manifest = read_manifest(path)
+    manifest[name] = fingerprint
+    write_manifest(path, manifest)
+    return df
+
+# Rebuild the stale datasets a consumer depends on and return their names
+def refresh(target, path=DATA_PATH, force=False):
+    if force:
+        names = STAGE_DEPENDENCIES.get(target, [target])
+    else:
+        names = stale_stages(target, path)
+    for name in names:
+        run_stage(name, path, force=force)
+    return names
+
+# Build every processed dataset, also exporting the CSV versions
+def process_main(path=DATA_PATH, force=False, export_csv=True):
+    df_Carbon = run_stage("Carbon", path, force, export_csv=export_csv)
+    run_stage("RedditPosts", path, force, export_csv=export_csv)
+    df_Reddit = run_stage("Reddit", path, force, export_csv=export_csv)
+    df_Disaster = run_stage("Disaster", path, force, export_csv=export_csv)
+    df_Temperature = run_stage("Temperature", path, force, export_csv=export_csv)
+    # Built here once rather than by the first analysis or dashboard process
+    # needing them; they only feed those, so they are not exported as CSV
+    run_stage("WordFrequency", path, force)
+    run_stage("Cube", path, force)
 
     return df_Carbon, df_Reddit, df_Disaster, df_Temperature
 
-df_Carbon, df_Reddit, df_Disaster, df_Temperature = process_main()
+# Load a processed dataset on first access and memoize it for the process.
+# The returned frame is shared between callers, so it must not be mutated.
+@lru_cache(maxsize=None)
+def load_dataset(name, path=DATA_PATH):
+    # Read before the data, so the version recorded is never newer than it
+    _loaded_versions[(name, path)] = dataset_version(name, path)
+    return run_stage(name, path)
+
+# Version of each memoized dataset at the time it was loaded
+_loaded_versions = {}
+
+# Identifies the current content of a processed dataset: its recorded stage
+# fingerprint, or the stored file's size and mtime when it has none
+def dataset_version(name, path=DATA_PATH):
+    fingerprint = read_manifest(path).get(name)
+    if fingerprint is None:
+        output = _get_stage(name)["output"]
+        files = [parquet_path(output, path), csv_path(output, path)]
+        fingerprint = [
+            (os.stat(file).st_size, os.stat(file).st_mtime_ns)
+            for file in files
+            if os.path.exists(file)
+        ]
+    return value_fingerprint(fingerprint)
+
+# Index a processed dataset by year so per-year views are plain dict lookups
+@lru_cache(maxsize=None)
+def load_year_index(name, path=DATA_PATH):
+    df = load_dataset(name, path)
+    return {int(year): frame for year, frame in df.groupby("Year")}
+
+# Rows of a processed dataset for a single year (empty frame if none)
+def load_year_slice(name, year, path=DATA_PATH):
+    year_index = load_year_index(name, path)
+    if int(year) not in year_index:
+        return load_dataset(name, path).iloc[0:0]
+    return year_index[int(year)]
+
+# Rows of a processed dataset for a single year and the version they belong
+# to. Memoized data older than the stored version (e.g. after a nightly
+# refresh) is dropped and loaded again, so a long-lived process never
+# pairs the current version with stale rows.
+def load_versioned_year_slice(name, year, path=DATA_PATH):
+    version = dataset_version(name, path)
+    loaded = _loaded_versions.get((name, path))
+    if loaded is not None and loaded != version:
+        clear_dataset_cache()
+    frame = load_year_slice(name, year, path)
+    return frame, _loaded_versions[(name, path)]
+
+# Drop every memoized dataset, e.g. after the raw files were refreshed
+def clear_dataset_cache():
+    load_year_index.cache_clear()
+    load_dataset.cache_clear()
+    _loaded_versions.clear()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process the raw datasets")
+    parser.add_argument(
+        "--force", action="store_true", help="rebuild every processed dataset"
+    )
+    parser.add_argument(
+        "--no-csv", action="store_true", help="only write the Parquet outputs"
+    )
+    parser.add_argument(
+        "--topics",
+        help="JSON file of Reddit topic keywords to install as the topic config "
+        "every process uses",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="",
+        help="profile every stage, optionally exporting to a .json/.csv file",
+    )
+    args = parser.parse_args()
+    if args.profile is not None:
+        enable_profiling()
+    if args.topics:
+        # Installed rather than only passed to this run, so the analysis and
+        # dashboard processes load the same topics instead of rebuilding the
+        # posts with the defaults
+        topic_keywords = load_topic_keywords(args.topics)
+        if os.path.abspath(args.topics) != os.path.abspath(TOPIC_CONFIG_PATH):
+            shutil.copyfile(args.topics, TOPIC_CONFIG_PATH)
+        PIPELINE_STAGES["RedditPosts"]["params"]["topic_keywords"] = topic_keywords
+    process_main(force=args.force, export_csv=not args.no_csv)
+    if args.profile is not None:
+        report_profile(args.profile)
 
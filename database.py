@@ -0,0 +1,305 @@
+"""This file contains the embedded SQL backend answering the cube queries."""
+
+import glob
+import os
+import sqlite3
+import threading
+from functools import lru_cache
+import pandas as pd
+from const import DATA_PATH, DATABASE_NAME, WORLD
+from cube import ALL, CUBE_SPEC
+from data_process import dataset_version, join_Reddit_data, run_stage
+from fingerprint import value_fingerprint
+from storage import apply_default_mode, parquet_path
+
+# DuckDB runs the queries in parallel and reads Parquet out-of-core, without
+# it the stdlib sqlite3 is used on a copy of the data
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+# Tables of the database: the processed datasets they are loaded from
+DATABASE_TABLES = {
+    "Carbon": ["Carbon"],
+    "Disaster": ["Disaster"],
+    "Temperature": ["Temperature"],
+    "Reddit": ["Reddit", "RedditPosts"],
+}
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _literal(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+# One SELECT per dataset x dimension x measure of the cube spec, aggregating
+# the rows of the dataset table by Year, Month, Country and category like
+# build_monthly_cube does
+def cube_sql(spec=CUBE_SPEC, columns=None):
+    selects = []
+    for dataset, dataset_spec in spec.items():
+        table = _quote(dataset)
+        dataset_columns = (columns or {}).get(dataset)
+        # Datasets without a country (Reddit) are filed under WORLD
+        if dataset_columns is not None and "Country" not in dataset_columns:
+            country = _literal(WORLD)
+        else:
+            country = _quote("Country")
+        for dimension in dataset_spec["dimensions"] or [None]:
+            if dimension is None:
+                category = _literal(ALL)
+            else:
+                category = f"CAST({_quote(dimension)} AS VARCHAR)"
+            for measure in dataset_spec["measures"]:
+                # e.g. Reddit data processed before the polarity was kept
+                if dataset_columns is not None and measure not in dataset_columns:
+                    total = "0.0"
+                else:
+                    total = f"COALESCE(SUM({_quote(measure)}), 0.0)"
+                selects.append(
+                    f"SELECT {_literal(dataset)} AS \"Dataset\", \"Year\", \"Month\", "
+                    f"{country} AS \"Country\", "
+                    f"{_literal(dimension or ALL)} AS \"Dimension\", "
+                    f"{category} AS \"Category\", {_literal(measure)} AS \"Measure\", "
+                    f"COUNT(*) AS \"Count\", {total} AS \"Sum\" "
+                    f"FROM {table} "
+                    f"WHERE \"Year\" IS NOT NULL AND \"Month\" IS NOT NULL "
+                    f"AND {country} IS NOT NULL AND {category} IS NOT NULL "
+                    f"GROUP BY \"Year\", \"Month\", {country}, {category}"
+                )
+    return "\nUNION ALL\n".join(selects)
+
+
+# Processed datasets and their monthly cube in an embedded database file.
+# query_cube takes the same arguments as cube.query_cube, so an instance can
+# stand in for the cube frame in Analysis and the plot functions.
+# Each version of the datasets gets its own file, built in a temporary file
+# renamed into place and only ever opened read-only afterwards, so any
+# number of processes (dashboard workers, the render pool) can query it
+# while another one builds the next version.
+class CubeDatabase:
+    def __init__(self, path=DATA_PATH, db_path=None, engine=None):
+        if engine is None:
+            engine = "duckdb" if duckdb is not None else "sqlite"
+        if engine == "duckdb" and duckdb is None:
+            raise ImportError("The duckdb engine needs the duckdb package")
+        if engine not in ("duckdb", "sqlite"):
+            raise ValueError(f"Unknown database engine {engine!r}")
+        if db_path is None:
+            db_path = os.path.join(path, f"{DATABASE_NAME}.{engine}")
+        self.path = path
+        self.engine = engine
+        self.db_path = db_path
+        # The connection is shared between threads under this lock
+        self._lock = threading.Lock()
+        self.connection = None
+        self.version_path = None
+        self.refresh()
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+            self.version_path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _connect(self, file_path, read_only):
+        if self.engine == "duckdb":
+            return duckdb.connect(file_path, read_only=read_only)
+        if read_only:
+            return sqlite3.connect(
+                f"file:{file_path}?mode=ro", uri=True, check_same_thread=False
+            )
+        return sqlite3.connect(file_path, check_same_thread=False)
+
+    def execute(self, sql, params=()):
+        with self._lock:
+            if self.engine == "duckdb":
+                return self.connection.execute(sql, list(params)).df()
+            return pd.read_sql_query(sql, self.connection, params=list(params))
+
+    def _versions(self):
+        return {
+            dataset: dataset_version(dataset, self.path)
+            for datasets in DATABASE_TABLES.values()
+            for dataset in datasets
+        }
+
+    # File of the database built from the given dataset versions, e.g.
+    # data/climate-1a2b3c4d5e6f7a8b.duckdb
+    def _version_path(self, versions):
+        root, extension = os.path.splitext(self.db_path)
+        return f"{root}-{value_fingerprint(versions)[:16]}{extension}"
+
+    # Switch to the database of the current dataset versions, building it
+    # if no process did yet. Returns whether the database changed.
+    def refresh(self):
+        versions = self._versions()
+        version_path = self._version_path(versions)
+        with self._lock:
+            if version_path == self.version_path:
+                return False
+            if not os.path.exists(version_path):
+                self._build_file(version_path, versions)
+            self.close()
+            self.connection = self._connect(version_path, read_only=True)
+            self.version_path = version_path
+        self._remove_old_versions(version_path)
+        return True
+
+    # Build into a file private to this process and thread, then rename it
+    # into place. Concurrent builders of the same version each rename an
+    # identical file, and readers never see a partial one.
+    def _build_file(self, version_path, versions):
+        tmp_path = f"{version_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        connection = self._connect(tmp_path, read_only=False)
+        try:
+            self._build(connection, versions)
+        except BaseException:
+            connection.close()
+            os.remove(tmp_path)
+            raise
+        connection.close()
+        apply_default_mode(tmp_path)
+        os.replace(tmp_path, version_path)
+
+    # Files of older versions. Processes still reading one keep their open
+    # file until they refresh; where an open file cannot be deleted (Windows)
+    # it is left for a later refresh to remove.
+    def _remove_old_versions(self, version_path):
+        root, extension = os.path.splitext(self.db_path)
+        pattern = f"{glob.escape(root)}-*{extension}"
+        for file_path in glob.glob(pattern):
+            if file_path != version_path:
+                try:
+                    os.remove(file_path)
+                except OSError:
+                    pass
+
+    # Drop a table or view, DuckDB refuses to drop one as the other
+    def _drop(self, connection, name):
+        kind = "TABLE"
+        if self.engine == "duckdb":
+            found = connection.execute(
+                "SELECT table_type FROM information_schema.tables WHERE table_name = ?",
+                [name],
+            ).fetchall()
+            if found and found[0][0] == "VIEW":
+                kind = "VIEW"
+        connection.execute(f"DROP {kind} IF EXISTS {_quote(name)}")
+
+    def _load_table(self, connection, name, df):
+        quoted = _quote(name)
+        if self.engine == "duckdb":
+            self._drop(connection, name)
+            connection.register("_frame", df)
+            connection.execute(f"CREATE TABLE {quoted} AS SELECT * FROM _frame")
+            connection.unregister("_frame")
+        else:
+            # sqlite has no categorical type, categories are stored as text
+            df = df.astype(
+                {
+                    column: "object"
+                    for column, dtype in df.dtypes.items()
+                    if isinstance(dtype, pd.CategoricalDtype)
+                }
+            )
+            df.to_sql(name, connection, if_exists="replace", index=False)
+
+    # With DuckDB the datasets stored as Parquet are queried in place
+    def _load_view(self, connection, name, dataset):
+        output = parquet_path(f"Processed_{dataset}", self.path)
+        if self.engine != "duckdb" or not os.path.exists(output):
+            return False
+        self._drop(connection, name)
+        connection.execute(
+            f"CREATE VIEW {_quote(name)} AS "
+            f"SELECT * FROM read_parquet({_literal(os.path.abspath(output))})"
+        )
+        return True
+
+    def _build(self, connection, versions):
+        columns = {}
+        for name, datasets in DATABASE_TABLES.items():
+            if name == "Reddit":
+                df = join_Reddit_data(
+                    run_stage("Reddit", self.path), run_stage("RedditPosts", self.path)
+                )
+                self._load_table(connection, name, df)
+            elif not self._load_view(connection, name, datasets[0]):
+                df = run_stage(datasets[0], self.path)
+                self._load_table(connection, name, df)
+            else:
+                df = connection.execute(f"SELECT * FROM {_quote(name)} LIMIT 0").df()
+            columns[name] = list(df.columns)
+
+        connection.execute("DROP TABLE IF EXISTS cube")
+        connection.execute(f"CREATE TABLE cube AS {cube_sql(CUBE_SPEC, columns)}")
+        connection.execute(
+            'CREATE INDEX cube_cells ON cube ("Dataset", "Measure", "Dimension", "Year")'
+        )
+        connection.execute("DROP TABLE IF EXISTS versions")
+        connection.execute('CREATE TABLE versions ("Dataset" VARCHAR, "Version" VARCHAR)')
+        connection.executemany(
+            "INSERT INTO versions VALUES (?, ?)", list(versions.items())
+        )
+        connection.commit()
+
+    # Same query as cube.query_cube, answered by the database
+    def query_cube(
+        self,
+        dataset,
+        measure=None,
+        dimension=None,
+        years=None,
+        countries=None,
+        exclude_countries=None,
+        by=("Year", "Month"),
+    ):
+        spec = CUBE_SPEC[dataset]
+        if measure is None:
+            measure = spec["measures"][0]
+        if dimension is None:
+            dimension = spec["dimensions"][0] if spec["dimensions"] else ALL
+
+        conditions = ['"Dataset" = ?', '"Measure" = ?', '"Dimension" = ?']
+        params = [dataset, measure, dimension]
+        for column, values, operator in [
+            ("Year", years, "IN"),
+            ("Country", countries, "IN"),
+            ("Country", exclude_countries, "NOT IN"),
+        ]:
+            if values is None:
+                continue
+            values = [int(value) if column == "Year" else str(value) for value in values]
+            if not values:
+                # Nothing is in an empty list, everything is out of it
+                if operator == "IN":
+                    conditions.append("1 = 0")
+                continue
+            placeholders = ", ".join("?" for _ in values)
+            conditions.append(f"{_quote(column)} {operator} ({placeholders})")
+            params.extend(values)
+
+        keys = ", ".join(_quote(column) for column in by)
+        return self.execute(
+            f'SELECT {keys}, SUM("Count") AS "Count", SUM("Sum") AS "Sum" '
+            f"FROM cube WHERE {' AND '.join(conditions)} "
+            f"GROUP BY {keys} ORDER BY {keys}",
+            params,
+        )
+
+
+# Database of the processed datasets in `path`, opened once per process
+@lru_cache(maxsize=None)
+def open_database(path=DATA_PATH, engine=None):
+    return CubeDatabase(path, engine=engine)
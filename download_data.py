@@ -1,11 +1,26 @@
 """this file is used to download the data from the website and save it to the data folder"""
 
+import argparse
+import json
 import os
-from io import StringIO
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from const import (
+    DATA_PATH,
+    DOWNLOAD_RETRIES,
+    DOWNLOAD_TIMEOUT,
+    DOWNLOAD_WORKERS,
+    OFFLINE,
+)
+from profiling import enable as enable_profiling, profiled, report_profile
+from storage import apply_default_mode
+from temperature_store import parse_berkeley_earth, write_temperature_store
 
-path = "data"
+path = DATA_PATH
 
 # Carbon Monitor dataset URL
 carbon_monitor_url = (
@@ -64,53 +79,249 @@ urls_countries = [
     ),
 ]
 
-# Download the Carbon Monitor dataset
-def download_carbon_monitor_dataset(path, url):
-    response = requests.get(url)
-    with open(os.path.join(path, "Carbon.csv"), "wb") as file:
-        file.write(response.content)
+# Folder of the raw Berkeley Earth files, combined into Anomaly_Temp.csv
+TEMPERATURE_RAW_DIR = "Berkeley_Earth"
 
-# Download the temperature dataset
-def download_temperature_dataset(path, urls_countries):
-    all_data = pd.DataFrame()
+# Session shared by the download threads: pooled connections and retries
+# with exponential backoff on connection errors and transient statuses
+def make_session(retries=DOWNLOAD_RETRIES, pool_size=DOWNLOAD_WORKERS):
+    retry = Retry(
+        total=retries,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def _metadata_path(target):
+    return target + ".meta.json"
+
+# Body received so far by an interrupted download of target
+def _partial_path(target):
+    return target + ".part"
+
+def _read_metadata(file_path, url):
+    if not os.path.exists(file_path) or not os.path.exists(_metadata_path(file_path)):
+        return None
+    with open(_metadata_path(file_path)) as file:
+        metadata = json.load(file)
+    return metadata if metadata.get("url") == url else None
+
+def _remove_partial(partial):
+    for file_path in [partial, _metadata_path(partial)]:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+# A response cut off while its body was being received, the only failure
+# download_files retries itself (the session retries the requests)
+class TransferInterrupted(requests.RequestException):
+    pass
+
+# Download url to target, streaming the body to disk. The ETag and
+# Last-Modified of the previous download are sent along, so an unchanged
+# file is skipped. The body is streamed into target.part, renamed into place
+# once complete. An interrupted download keeps the part, and the next call
+# asks for the rest with a Range request, validated with If-Range against
+# the version the part came from. Returns True if the file was (re)written.
+def download_file(session, url, target, timeout=DOWNLOAD_TIMEOUT):
+    partial = _partial_path(target)
+    headers = {}
+    offset = 0
+    partial_metadata = _read_metadata(partial, url)
+    if partial_metadata is not None:
+        offset = os.path.getsize(partial)
+        headers["Range"] = f"bytes={offset}-"
+        headers["If-Range"] = partial_metadata["etag"] or partial_metadata["last_modified"]
+        headers["Accept-Encoding"] = "identity"
+    else:
+        _remove_partial(partial)
+        metadata = _read_metadata(target, url)
+        if metadata is not None:
+            if metadata.get("etag"):
+                headers["If-None-Match"] = metadata["etag"]
+            if metadata.get("last_modified"):
+                headers["If-Modified-Since"] = metadata["last_modified"]
+
+    with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+        if response.status_code == 304:
+            return False
+        if response.status_code == 416:
+            # The part is not a prefix of the current version, start over
+            _remove_partial(partial)
+            return download_file(session, url, target, timeout)
+        response.raise_for_status()
+
+        metadata = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        resumed = response.status_code == 206 and response.headers.get(
+            "Content-Range", ""
+        ).startswith(f"bytes {offset}-")
+        if not resumed:
+            _remove_partial(partial)
+            if response.status_code == 206:
+                # Not the range asked for, start over without one
+                return download_file(session, url, target, timeout)
+        # Only bodies sent as is, under a validator, can be resumed by offset
+        resumable = (metadata["etag"] or metadata["last_modified"]) and (
+            response.headers.get("Content-Encoding", "identity") == "identity"
+        )
+        if resumable and not resumed:
+            with open(_metadata_path(partial), "w") as file:
+                json.dump(metadata, file)
+
+        try:
+            with open(partial, "ab" if resumed else "wb") as file:
+                for block in response.iter_content(chunk_size=1 << 16):
+                    file.write(block)
+        except (
+            requests.exceptions.ChunkedEncodingError,
+            requests.ConnectionError,
+        ) as error:
+            if not (resumable or resumed):
+                _remove_partial(partial)
+            raise TransferInterrupted(error, request=response.request) from error
+        except BaseException:
+            if not (resumable or resumed):
+                _remove_partial(partial)
+            raise
+        apply_default_mode(partial)
+        os.replace(partial, target)
+        _remove_partial(partial)
+
+    with open(_metadata_path(target), "w") as file:
+        json.dump(metadata, file)
+    return True
+
+# Download every (url, target) pair concurrently. Returns {target: changed},
+# with None for the downloads that failed.
+@profiled
+def download_files(
+    downloads, session=None, workers=DOWNLOAD_WORKERS, retries=DOWNLOAD_RETRIES
+):
+    session = session or make_session(pool_size=workers)
+
+    def fetch(download):
+        url, target = download
+        # The session already retries failed requests and transient statuses
+        # with backoff, only a transfer cut off midway is tried again here,
+        # resuming from the received part
+        for attempt in range(retries + 1):
+            try:
+                return download_file(session, url, target)
+            except TransferInterrupted as error:
+                if attempt == retries:
+                    print(f"Failed to download {url}: {error}")
+            except requests.RequestException as error:
+                print(f"Failed to download {url}: {error}")
+                break
+        return None
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(fetch, downloads))
+    return {target: changed for (_, target), changed in zip(downloads, results)}
+
+def temperature_file_path(path, url):
+    return os.path.join(path, TEMPERATURE_RAW_DIR, url.rsplit("/", 1)[-1])
+
+# Parse the raw Berkeley Earth files and write the combined Anomaly_Temp.csv,
+# concatenating all countries once at the end, and the per-country store the
+# Temperature processing slices its years from
+@profiled
+def combine_temperature_dataset(path, urls_countries):
+    frames = []
     for url, country in urls_countries:
-        response = requests.get(url)
-        if response.status_code == 200:
-            data = pd.read_csv(
-                StringIO(response.text), comment="%", sep="\s+", header=None
-            )
-            columns = [
-                "Year",
-                "Month",
-                "Monthly Anomaly",
-                "Monthly Uncertainty",
-                "Annual Anomaly",
-                "Annual Uncertainty",
-                "Five-year Anomaly",
-                "Five-year Uncertainty",
-                "Ten-year Anomaly",
-                "Ten-year Uncertainty",
-                "Twenty-year Anomaly",
-                "Twenty-year Uncertainty",
-            ]
-            data.columns = columns
-            data["Country"] = country
-
-            # Append to the all_data DataFrame
-            all_data = pd.concat([all_data, data])
-        else:
-            print(
-                f"Failed to download data for {country}. Status code:",
-                response.status_code,
-            )
-    # Reset index of the final DataFrame
-    all_data.reset_index(drop=True, inplace=True)
-
-    # Save the combined DataFrame to a CSV file
-    all_data.to_csv(os.path.join(path, "Anomaly_Temp.csv"), index=False)
+        file_path = temperature_file_path(path, url)
+        if not os.path.exists(file_path):
+            print(f"Missing temperature data for {country}: {file_path}")
+            continue
+        data = parse_berkeley_earth(file_path)
+        data["Country"] = country
+        frames.append(data)
+
+    all_data = pd.concat(frames, ignore_index=True)
+    combined_path = os.path.join(path, "Anomaly_Temp.csv")
+    all_data.to_csv(combined_path, index=False)
+    write_temperature_store(all_data, path, combined_path)
+    return all_data
 
 # Download the Carbon Monitor dataset
-download_carbon_monitor_dataset(path, carbon_monitor_url)
+def download_carbon_monitor_dataset(path, url, session=None):
+    target = os.path.join(path, "Carbon.csv")
+    return download_files([(url, target)], session)[target]
 
 # Download the temperature dataset
-download_temperature_dataset(path, urls_countries)
+def download_temperature_dataset(path, urls_countries, session=None):
+    os.makedirs(os.path.join(path, TEMPERATURE_RAW_DIR), exist_ok=True)
+    downloads = [(url, temperature_file_path(path, url)) for url, _ in urls_countries]
+    results = download_files(downloads, session)
+    combined_path = os.path.join(path, "Anomaly_Temp.csv")
+    if any(results.values()) or not os.path.exists(combined_path):
+        combine_temperature_dataset(path, urls_countries)
+    return results
+
+# Fetch every source concurrently over one session. In offline mode the
+# already downloaded data folder is used without touching the network.
+# The sources default to the module URLs and can be pointed elsewhere, e.g.
+# at a local mirror.
+def download_main(
+    path=DATA_PATH,
+    offline=OFFLINE,
+    carbon_url=carbon_monitor_url,
+    temperature_urls=urls_countries,
+    session=None,
+):
+    if offline:
+        missing = [
+            file_name
+            for file_name in ["Carbon.csv", "Anomaly_Temp.csv"]
+            if not os.path.exists(os.path.join(path, file_name))
+        ]
+        if missing:
+            print(f"Offline mode, missing downloaded files: {missing}")
+        return
+
+    os.makedirs(os.path.join(path, TEMPERATURE_RAW_DIR), exist_ok=True)
+    carbon_target = os.path.join(path, "Carbon.csv")
+    temperature_downloads = [
+        (url, temperature_file_path(path, url)) for url, _ in temperature_urls
+    ]
+    with nullcontext(session) if session else make_session() as session:
+        results = download_files(
+            [(carbon_url, carbon_target)] + temperature_downloads, session
+        )
+
+    combined_path = os.path.join(path, "Anomaly_Temp.csv")
+    temperature_changed = [results[target] for _, target in temperature_downloads]
+    if any(temperature_changed) or not os.path.exists(combined_path):
+        combine_temperature_dataset(path, temperature_urls)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download the raw datasets")
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        default=OFFLINE,
+        help="use the already downloaded data folder",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="",
+        help="profile the downloads, optionally exporting to a .json/.csv file",
+    )
+    args = parser.parse_args()
+    if args.profile is not None:
+        enable_profiling()
+    download_main(path, args.offline)
+    if args.profile is not None:
+        report_profile(args.profile)
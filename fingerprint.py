@@ -0,0 +1,83 @@
+"""This file contains the helpers used to fingerprint pipeline inputs and code."""
+
+import hashlib
+import inspect
+import json
+import os
+import tempfile
+from storage import apply_default_mode
+
+# Name of the manifest recording the fingerprint of every processed output
+MANIFEST_NAME = "pipeline_manifest.json"
+
+
+# Size, modification time and content hash of a file. The hash of the
+# previous fingerprint is reused when size and mtime are unchanged.
+def file_fingerprint(file_path, previous=None):
+    stat = os.stat(file_path)
+    fingerprint = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if (
+        previous is not None
+        and previous.get("size") == fingerprint["size"]
+        and previous.get("mtime_ns") == fingerprint["mtime_ns"]
+    ):
+        fingerprint["sha256"] = previous["sha256"]
+        return fingerprint
+
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    fingerprint["sha256"] = digest.hexdigest()
+    return fingerprint
+
+
+# Hash of the source code of the functions producing an output
+def code_fingerprint(*functions):
+    digest = hashlib.sha256()
+    for function in functions:
+        digest.update(inspect.getsource(function).encode("utf-8"))
+    return digest.hexdigest()
+
+
+# Hash of any JSON-serializable value, e.g. the parameters of a stage.
+# Other values are hashed by repr, which (unlike str) spells out the
+# categories of a CategoricalDtype.
+def value_fingerprint(value):
+    encoded = json.dumps(value, sort_keys=True, default=repr).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+# Two fingerprints describe the same content if everything but size/mtime matches
+def same_content(old, new):
+    if old is None or new is None:
+        return False
+    if old.keys() != new.keys():
+        return False
+    for key, value in new.items():
+        if isinstance(value, dict) and "sha256" in value:
+            if old[key] is None or old[key].get("sha256") != value["sha256"]:
+                return False
+        elif isinstance(value, dict):
+            if not same_content(old[key], value):
+                return False
+        elif old[key] != value:
+            return False
+    return True
+
+
+def read_manifest(path):
+    manifest_path = os.path.join(path, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as file:
+        return json.load(file)
+
+
+# Write the manifest atomically so concurrent readers never see a partial file
+def write_manifest(path, manifest):
+    fd, tmp_path = tempfile.mkstemp(dir=path, suffix=".tmp")
+    with os.fdopen(fd, "w") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    apply_default_mode(tmp_path)
+    os.replace(tmp_path, os.path.join(path, MANIFEST_NAME))
@@ -0,0 +1,31 @@
+"""This file contains the world country geometry used by the disaster map."""
+
+import os
+from functools import lru_cache
+import geopandas as gpd
+from const import DATA_PATH, WORLD_GEOMETRY_NAME, WORLD_GEOMETRY_TOLERANCE
+from countries import normalize_country
+
+
+# Convert a Natural Earth countries file (e.g. the naturalearth_lowres
+# shapefile once bundled with geopandas) into the vendored GeoParquet store
+def build_world_geometry(source, path=DATA_PATH):
+    world = gpd.read_file(source)
+    world = world[["name", "iso_a3", "continent", "geometry"]]
+    # Canonical names for the countries of the index, e.g. "Russian
+    # Federation" -> "Russia", Natural Earth names for the others
+    canonical = normalize_country(world["name"]).astype("object")
+    world["name"] = canonical.fillna(world["name"])
+    world.to_parquet(os.path.join(path, WORLD_GEOMETRY_NAME), index=False)
+    return world
+
+
+# Country geometry indexed by ISO3 code (iso_a3), read once per process. The
+# outlines are simplified to `tolerance` degrees, enough for screen display.
+# The returned frame is shared between callers, so it must not be mutated.
+@lru_cache(maxsize=None)
+def load_world_geometry(path=DATA_PATH, tolerance=WORLD_GEOMETRY_TOLERANCE):
+    world = gpd.read_parquet(os.path.join(path, WORLD_GEOMETRY_NAME))
+    if tolerance:
+        world["geometry"] = world.simplify(tolerance, preserve_topology=True)
+    return world.set_index("iso_a3")
@@ -1,49 +1,49 @@
-import geopandas as gpd
+import argparse
 import os
+from functools import lru_cache
 import numpy as np
 import matplotlib.pyplot as plt
-from wordcloud import WordCloud, STOPWORDS
+from wordcloud import WordCloud
 from analysis import Analysis
-from const import DATA_PATH, SPECIFIED_COUNTRIES, IMAGES_PATH
-from data_process import (
-    process_Carbon_data,
-    process_Reddit_data,
-    process_Temperature_data,
-    process_Disaster_data
+from const import (
+    DATA_PATH,
+    IMAGES_PATH,
+    SPECIFIED_COUNTRIES,
+    WORD_CLOUD_KEYWORDS,
+    WORD_CLOUD_STOPWORDS,
+    YEARS,
 )
-
-def plot_word_cloud():
-    # Process Reddit data
-    reddit_data = process_Reddit_data(DATA_PATH)
-    comments = reddit_data["Comment"].dropna().tolist()  # Ensure no NaN values
-
-    # Define keywords related to climate change
-    climate_keywords = [
-        "climate", "global warming", "emission", "carbon", "greenhouse", "environment",
-        "sustainability", "pollution", "renewable", "ecology", "conservation", "biodiversity",
-        "fossil fuels", "deforestation", "recycling", "solar", "wind energy", "eco-friendly"
-    ]
-    # Filter comments to include only those with climate change keywords
-    filtered_comments = []
-    for comment in comments:
-        if any(keyword in comment.lower() for keyword in climate_keywords):
-            filtered_comments.append(comment)
-
-    # Combine filtered comments into a single string
-    text = " ".join(filtered_comments)
-    # Define a set of stop words to be excluded from the word cloud
-    custom_stopwords = set(STOPWORDS)
-    additional_stopwords = {"will", "one", "now", "use", "also", "like", "say", "make", "https", "due",
-                            "get", "go", "going", "know", "see", "want", "think", "take", "need", "look"} 
-    custom_stopwords.update(additional_stopwords)
+from cube import query_cube
+from data_process import load_dataset, load_versioned_year_slice
+from fingerprint import code_fingerprint
+from countries import country_code
+from geometry import load_world_geometry
+from profiling import enable as enable_profiling, profiled, report_profile
+from render_cache import cached_render
+from schema import SENTIMENT_LABELS
+from word_frequency import compile_keyword_matcher, count_tokens, word_frequencies
+
+# Every plot function accepts pre-loaded processed frames or monthly cube
+# (e.g. from the dashboard's shared cache) and falls back to the dataset
+# registry otherwise. With save=False the figure is only returned, without
+# overwriting the static image in IMAGES_PATH.
+
+@profiled
+def plot_word_cloud(reddit_data=None):
+    # Word frequencies of the climate related comments, from the persisted
+    # WordFrequency table or counted from the given Reddit data
+    if reddit_data is None:
+        frequencies = load_dataset("WordFrequency", DATA_PATH)
+    else:
+        counts = count_tokens(reddit_data["Comment"], compile_keyword_matcher(WORD_CLOUD_KEYWORDS))
+        frequencies = word_frequencies(counts, WORD_CLOUD_STOPWORDS)
 
     # Create a word cloud instance with your custom configurations
     wordcloud = WordCloud(
         width=800, 
         height=600, 
-        stopwords=custom_stopwords,
         background_color="white",
-    ).generate(text)
+    ).generate_from_frequencies(dict(zip(frequencies["Word"], frequencies["Count"])))
 
     # Display the word cloud using matplotlib
     plt.figure(figsize=(10, 8))
@@ -52,8 +52,10 @@ def plot_word_cloud():
     plt.savefig(os.path.join(IMAGES_PATH, 'word_cloud.png'))
 
 
-def plot_monthly_temperature_anomalies(year: int):
-    df_Temperature = process_Temperature_data(DATA_PATH)
+@profiled
+def plot_monthly_temperature_anomalies(year: int, df_Temperature=None, save=True):
+    if df_Temperature is None:
+        df_Temperature = load_dataset("Temperature", DATA_PATH)
     year_data = df_Temperature[df_Temperature["Year"] == year]
     year_data = year_data[year_data["Country"].isin(SPECIFIED_COUNTRIES)]
     fig, ax = plt.subplots(figsize=(20, 8))
@@ -80,17 +82,19 @@ def plot_monthly_temperature_anomalies(year: int):
     ax.set_ylabel("Temperature Anomalies")
     ax.legend(bbox_to_anchor=(1.02, 1))
     ax.set_title(f"Monthly Temperature Anomalies in {year}")
-    plt.savefig(os.path.join(IMAGES_PATH, f'temperature_anomalies_{year}.png'))
+    if save:
+        plt.savefig(os.path.join(IMAGES_PATH, f'temperature_anomalies_{year}.png'))
 
     return fig
 
-def plot_monthly_carbon_emissions(year: int):
-    df_Carbon = process_Carbon_data(DATA_PATH)
-    year_data = df_Carbon[df_Carbon["Year"] == year]
-    year_data = year_data[year_data["Country"].isin(SPECIFIED_COUNTRIES)]
+@profiled
+def plot_monthly_carbon_emissions(year: int, cube=None, save=True):
+    if cube is None:
+        cube = load_dataset("Cube", DATA_PATH)
 
     # Aggregate emissions across all sectors for each country and month
-    aggregated_data = year_data.groupby(["Month", "Country"])["Value"].sum().reset_index()
+    aggregated_data = query_cube(cube, "Carbon", years=[year], countries=SPECIFIED_COUNTRIES,
+                                 by=["Month", "Country"]).rename(columns={"Sum": "Value"})
 
     # Determine the number of countries and create a bar width
     num_countries = len(SPECIFIED_COUNTRIES)
@@ -119,51 +123,49 @@ def plot_monthly_carbon_emissions(year: int):
     # Show the figure
     plt.xticks(rotation=45)
     plt.tight_layout()
-    plt.savefig(os.path.join(IMAGES_PATH, f'carbon_emissions_{year}.png'))
+    if save:
+        plt.savefig(os.path.join(IMAGES_PATH, f'carbon_emissions_{year}.png'))
     return fig
 
-def plot_disaster_frequency(year: int):
-    df_Disaster = process_Disaster_data(DATA_PATH, SPECIFIED_COUNTRIES, 'ROW', 'WORLD')
-
-    # Filter the disaster data for the specified year
-    yearly_data = df_Disaster[df_Disaster['Year'] == year]
-    # Group the data by country and count the frequency of disasters
-    disaster_frequency = yearly_data.groupby('Country').size().reset_index(name='Frequency')
-
-    world = gpd.read_file(gpd.datasets.get_path('naturalearth_lowres'))
-    
-    # renaming of "United States of America" to "United States" and "Russian Federation" to "Russia"
-    world['name'] = world['name'].replace({'United States of America': 'United States', 
-                                            'Russian Federation': 'Russia'})
-
-    # Merge the world GeoDataFrame with the disaster frequency DataFrame
-    merged_gdf = world.merge(disaster_frequency, how='left', left_on='name', right_on='Country')
-    merged_gdf['Frequency'] = merged_gdf['Frequency'].fillna(0)
+@profiled
+def plot_disaster_frequency(year: int, cube=None, save=True):
+    if cube is None:
+        cube = load_dataset("Cube", DATA_PATH)
+
+    # Count the frequency of disasters by country for the specified year
+    disaster_frequency = query_cube(cube, "Disaster", years=[year], by=["Country"])
+    disaster_frequency = disaster_frequency[["Country", "Count"]].rename(columns={"Count": "Frequency"})
+
+    # Join the frequencies on the ISO3 index of the cached world geometry
+    world = load_world_geometry()
+    frequency = disaster_frequency.set_index(
+        country_code(disaster_frequency["Country"]).to_numpy()
+    )["Frequency"]
+    world_frequency = world.assign(Frequency=frequency.reindex(world.index).to_numpy())
     fig, ax = plt.subplots(1, 1, figsize=(22, 8))
 
-    # Plot countries with frequency data
-    merged_gdf[merged_gdf['Frequency'] > 0].plot(column='Frequency', ax=ax, legend=True,
-                    legend_kwds={'label': "Frequency of Disasters by Country",
-                                 'orientation': "vertical"})
-    
-    # Plot countries without frequency data in white (or any color of your choice)
-    merged_gdf[merged_gdf['Frequency'] == 0].plot(ax=ax, color='white')
-    # Outline all countries
-    merged_gdf.boundary.plot(ax=ax, linewidth=1, color='black')
+    # Plot every country in one pass: countries with frequency data are colored,
+    # countries without it are white, all are outlined in black
+    world_frequency.plot(column='Frequency', ax=ax, legend=True, edgecolor='black', linewidth=1,
+                         missing_kwds={'color': 'white'},
+                         legend_kwds={'label': "Frequency of Disasters by Country",
+                                      'orientation': "vertical"})
 
     ax.set_title(f'Frequency of Disasters in {year} the specific country', fontsize=25)
     ax.set_axis_off()
-    plt.savefig(os.path.join(IMAGES_PATH, f'disaster_frequency_{year}.png'))
+    if save:
+        plt.savefig(os.path.join(IMAGES_PATH, f'disaster_frequency_{year}.png'))
     return fig
 
-def plot_sentiment_disaster_comparison(year: int):
-    df_Reddit = process_Reddit_data(DATA_PATH)
-    reddit_year_data = df_Reddit[df_Reddit['Year'] == year]
-    sentiment_monthly = reddit_year_data.groupby(['Month', 'Comment_Sentiment']).size().unstack(fill_value=0).reindex()
-    
-    df_Disaster = process_Disaster_data(DATA_PATH, SPECIFIED_COUNTRIES, 'ROW', 'WORLD')
-    disaster_year_data = df_Disaster[df_Disaster['Year'] == year]
-    disaster_frequency_monthly = disaster_year_data.groupby('Month').size().reindex()
+@profiled
+def plot_sentiment_disaster_comparison(year: int, cube=None, save=True):
+    if cube is None:
+        cube = load_dataset("Cube", DATA_PATH)
+    sentiment_monthly = query_cube(cube, "Reddit", years=[year], by=["Month", "Category"])
+    sentiment_monthly = sentiment_monthly.pivot(index="Month", columns="Category", values="Count")
+    sentiment_monthly = sentiment_monthly.reindex(columns=SENTIMENT_LABELS, fill_value=0).fillna(0)
+
+    disaster_frequency_monthly = query_cube(cube, "Disaster", years=[year], by=["Month"]).set_index("Month")["Count"]
 
     fig, ax1 = plt.subplots(figsize=(14, 7))
     
@@ -184,20 +186,57 @@ def plot_sentiment_disaster_comparison(year: int):
 
     ax1.legend(['Positive Sentiment', 'Negative Sentiment'], loc='upper left')
     ax2.legend(['Disaster Frequency'], loc='upper right')
-    plt.savefig(os.path.join(IMAGES_PATH, f'sentiment_disaster_comparison_{year}.png'))
+    if save:
+        plt.savefig(os.path.join(IMAGES_PATH, f'sentiment_disaster_comparison_{year}.png'))
 
     return fig
 
+# Plots shown on the dashboard: the function and the dataset it reads
+DASHBOARD_PLOTS = {
+    "monthly_temperature_anomalies": (plot_monthly_temperature_anomalies, "Temperature"),
+    "monthly_carbon_emissions": (plot_monthly_carbon_emissions, "Cube"),
+    "disaster_frequency": (plot_disaster_frequency, "Cube"),
+    "sentiment_disaster_comparison": (plot_sentiment_disaster_comparison, "Cube"),
+}
+
+# Source of a dashboard plot function, so a changed plot is rendered again
+@lru_cache(maxsize=None)
+def _plot_code_version(plot):
+    return code_fingerprint(DASHBOARD_PLOTS[plot][0])
+
+# Image of a dashboard plot for a year, served from the render cache when
+# neither the data it reads nor its code changed since it was rendered. The
+# data and the version in the key come from one snapshot.
+@profiled
+def render_dashboard_plot(plot, year: int, path=DATA_PATH):
+    plot_function, dataset = DASHBOARD_PLOTS[plot]
+    data, version = load_versioned_year_slice(dataset, year, path)
+
+    def render():
+        return plot_function(year, data, save=False)
+
+    params = {"year": year, "code": _plot_code_version(plot)}
+    return cached_render(plot, params, version, render)
+
 def main ():
     plot_word_cloud()
-    plot_monthly_temperature_anomalies(2019)
-    plot_monthly_temperature_anomalies(2020)
-    plot_monthly_carbon_emissions(2019)
-    plot_monthly_carbon_emissions(2020)
-    plot_disaster_frequency(2019)
-    plot_disaster_frequency(2020)
-    plot_sentiment_disaster_comparison(2019)
-    plot_sentiment_disaster_comparison(2020)
+    for year in YEARS:
+        plot_monthly_temperature_anomalies(year)
+        plot_monthly_carbon_emissions(year)
+        plot_disaster_frequency(year)
+        plot_sentiment_disaster_comparison(year)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Draw every plot")
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="",
+        help="profile every plot, optionally exporting to a .json/.csv file",
+    )
+    args = parser.parse_args()
+    if args.profile is not None:
+        enable_profiling()
+    main()
+    if args.profile is not None:
+        report_profile(args.profile)
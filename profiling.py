@@ -0,0 +1,204 @@
+"""This file contains the opt-in timing and memory profiling of the pipeline."""
+
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+import pandas as pd
+from const import PROFILING
+
+PROFILE_COLUMNS = [
+    "Stage",
+    "Start",
+    "Wall Seconds",
+    "CPU Seconds",
+    "Peak MB",
+    "Rows",
+]
+
+# Recorded stages, in the order they finished, and whether to record them
+_records = []
+_records_lock = threading.Lock()
+_enabled = PROFILING
+# Open stages of each thread, so nested stages report their own peak memory
+_local = threading.local()
+
+
+def enable(memory=True):
+    global _enabled
+    _enabled = True
+    # Tracing allocations slows Python code down, so it can be left off
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    global _enabled
+    _enabled = False
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def is_enabled():
+    return _enabled
+
+
+def clear():
+    with _records_lock:
+        _records.clear()
+
+
+# Number of rows of a stage result: frames and arrays by length, dicts of
+# results (e.g. the regression tables by year) by the sum of their lengths
+def count_rows(result):
+    if isinstance(result, dict):
+        counts = [count_rows(value) for value in result.values()]
+        counts = [count for count in counts if count is not None]
+        return sum(counts) if counts else None
+    if isinstance(result, (pd.DataFrame, pd.Series)) or hasattr(result, "shape"):
+        return len(result)
+    return None
+
+
+# Record the wall time, CPU time (including finished worker processes),
+# peak traced memory and rows of the enclosed code as one stage. Rows are
+# set on the yielded dict, e.g. stage["Rows"] = len(df). Does nothing unless
+# profiling is enabled, or `force` is set to only fill in the yielded dict.
+# Stages whose work runs in another process while this one serves others
+# (e.g. dashboard requests) set `local` to False: the CPU time and memory of
+# this process say nothing about them, so only their wall time is recorded.
+@contextmanager
+def profile_stage(name, rows=None, force=False, local=True):
+    if not (_enabled or force):
+        yield {}
+        return
+
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    record = {"Stage": name, "Rows": rows, "Peak MB": None, "CPU Seconds": None}
+
+    tracing = local and tracemalloc.is_tracing()
+    if tracing:
+        current, peak = tracemalloc.get_traced_memory()
+        # Keep the peak reached so far by the enclosing stage before resetting
+        if stack:
+            stack[-1]["_peak"] = max(stack[-1].get("_peak", peak), peak)
+        tracemalloc.reset_peak()
+        record["_start_memory"] = current
+        record["_peak"] = current
+    stack.append(record)
+
+    times = os.times()
+    start = time.perf_counter()
+    record["Start"] = time.time()
+    try:
+        yield record
+    finally:
+        wall = time.perf_counter() - start
+        end_times = os.times()
+        # Not necessarily the last one, stages of interleaved coroutines
+        # (e.g. dashboard requests) can finish in any order
+        stack.remove(record)
+        record["Wall Seconds"] = wall
+        if local:
+            record["CPU Seconds"] = sum(end_times[:4]) - sum(times[:4])
+        if tracing and tracemalloc.is_tracing():
+            peak = max(record.pop("_peak"), tracemalloc.get_traced_memory()[1])
+            record["Peak MB"] = (peak - record.pop("_start_memory")) / 1e6
+            if stack:
+                stack[-1]["_peak"] = max(stack[-1].get("_peak", peak), peak)
+        for key in ["_peak", "_start_memory"]:
+            record.pop(key, None)
+        # Forced measurements (e.g. dashboard latency) are not kept
+        if _enabled:
+            with _records_lock:
+                _records.append(record)
+
+
+# Attach extra values (e.g. cache hits and misses) to the innermost stage open
+# in this thread, exported along with its measurements
+def annotate_stage(values):
+    stack = getattr(_local, "stack", None)
+    if _enabled and stack:
+        stack[-1].update(values)
+
+
+# Decorator recording every call of a function as a stage named after it,
+# with the rows of its result
+def profiled(function=None, *, name=None):
+    if function is None:
+        return functools.partial(profiled, name=name)
+
+    stage_name = name or function.__qualname__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return function(*args, **kwargs)
+        with profile_stage(stage_name) as record:
+            result = function(*args, **kwargs)
+            record["Rows"] = count_rows(result)
+            return result
+
+    return wrapper
+
+
+def profile_records():
+    with _records_lock:
+        records = list(_records)
+    frame = pd.DataFrame(records)
+    # Annotations come after the measurements every stage has
+    frame = frame.reindex(
+        columns=PROFILE_COLUMNS
+        + [column for column in frame.columns if column not in PROFILE_COLUMNS]
+    )
+    frame["Start"] = pd.to_datetime(frame["Start"], unit="s")
+    return frame
+
+
+# Calls, total and mean wall time, CPU time, largest peak memory and total
+# rows of every stage, slowest first
+def profile_summary(records=None):
+    if records is None:
+        records = profile_records()
+    summary = records.groupby("Stage", sort=False).agg(
+        Calls=("Wall Seconds", "size"),
+        **{
+            "Wall Seconds": ("Wall Seconds", "sum"),
+            "Mean Wall Seconds": ("Wall Seconds", "mean"),
+            "CPU Seconds": ("CPU Seconds", lambda cpu: cpu.sum(min_count=1)),
+            "Peak MB": ("Peak MB", "max"),
+            "Rows": ("Rows", lambda rows: rows.sum(min_count=1)),
+        },
+    )
+    return summary.sort_values("Wall Seconds", ascending=False).round(3)
+
+
+# Write the records as JSON or CSV, chosen by the file extension
+def export_profile(file_path, records=None):
+    if records is None:
+        records = profile_records()
+    if file_path.endswith(".json"):
+        with open(file_path, "w") as file:
+            json.dump(
+                json.loads(records.to_json(orient="records", date_format="iso")),
+                file,
+                indent=2,
+            )
+    else:
+        records.to_csv(file_path, index=False)
+    return file_path
+
+
+# Print the summary table and export the records if a file is given, for the
+# --profile option of the command line scripts
+def report_profile(file_path=None):
+    records = profile_records()
+    print(profile_summary(records).to_string())
+    if file_path:
+        export_profile(file_path, records)
+        print(f"Profile written to {file_path}")
@@ -0,0 +1,217 @@
+"""This file contains the batch OLS engine used for the regressions."""
+
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+
+# Fit one OLS per group with stacked NumPy linear algebra.
+# X is (groups, n, k) and y is (groups, n). Groups with fewer than n
+# observations are padded with rows of zeros, which add nothing to X'X or
+# X'y; nobs gives the real number of observations of each group.
+def batch_ols(X, y, nobs=None):
+    X = np.asarray(X, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    if nobs is None:
+        nobs = np.full(X.shape[0], X.shape[1])
+
+    Xt = X.transpose(0, 2, 1)
+    XtX_inv = np.linalg.pinv(Xt @ X)
+    params = (XtX_inv @ (Xt @ y[..., None]))[..., 0]
+    resid = y - (X @ params[..., None])[..., 0]
+
+    # Same residual degrees of freedom as statsmodels: nobs - rank(X)
+    df_resid = nobs - np.linalg.matrix_rank(X)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sigma2 = (resid**2).sum(axis=1) / df_resid
+        bse = np.sqrt(sigma2[:, None] * np.diagonal(XtX_inv, axis1=1, axis2=2))
+        tvalues = params / bse
+    pvalues = 2 * stats.t.sf(np.abs(tvalues), df_resid[:, None])
+
+    return {
+        "params": params,
+        "bse": bse,
+        "tvalues": tvalues,
+        "pvalues": pvalues,
+        "df_resid": df_resid,
+    }
+
+
+# Same table as Analysis.format_regression_results, from one fitted group
+def format_regression_table(names, params, bse, tvalues, pvalues):
+    results_df = pd.DataFrame(
+        {
+            "Coefficient": np.round(params, 4),
+            "Std Error": np.round(bse, 4),
+            "t Value": np.round(tvalues, 4),
+            "P>|t|": np.round(pvalues, 4),
+        },
+        index=names,
+    )
+    results_df["Significance"] = results_df["P>|t|"].apply(
+        lambda x: "*" if x < 0.05 else ""
+    )
+    return results_df
+
+
+# Stack the observations of every group of df into padded design matrices,
+# placing each row by its group number and position within the group
+def stack_groups(df, y, x, by, add_constant=True):
+    x = [x] if isinstance(x, str) else list(x)
+    by = [by] if isinstance(by, str) else list(by)
+    names = (["const"] if add_constant else []) + x
+
+    grouped = df.groupby(by, sort=True, observed=True)
+    sizes = grouped.size()
+    codes = grouped.ngroup().to_numpy()
+    positions = grouped.cumcount().to_numpy()
+    # Rows with a missing group key are numbered -1 and left out
+    in_group = codes >= 0
+    codes, positions = codes[in_group], positions[in_group]
+
+    nobs = sizes.to_numpy()
+    n = nobs.max() if len(nobs) else 0
+    X = np.zeros((len(nobs), n, len(names)))
+    Y = np.zeros((len(nobs), n))
+    if add_constant:
+        X[codes, positions, 0] = 1.0
+    X[codes, positions, int(add_constant):] = df[x].to_numpy(dtype="float64")[in_group]
+    Y[codes, positions] = df[y].to_numpy(dtype="float64")[in_group]
+
+    return sizes.index.tolist(), names, X, Y, nobs
+
+
+# Regress y on x separately for every group of `by` (e.g. "Year", or
+# ["Year", "Country"]) in one batch. Returns {group: results table}.
+def fit_grouped_ols(df, y, x, by="Year", add_constant=True):
+    keys, names, X, Y, nobs = stack_groups(df, y, x, by, add_constant)
+    if not keys:
+        return {}
+    fit = batch_ols(X, Y, nobs)
+    return {
+        key: format_regression_table(
+            names,
+            fit["params"][index],
+            fit["bse"][index],
+            fit["tvalues"][index],
+            fit["pvalues"][index],
+        )
+        for index, key in enumerate(keys)
+    }
+
+
+# Fit several specifications {name: (y, x)} over the groups of `by`.
+# Returns {(name, group): results table}.
+def fit_specifications(df, specifications, by="Year", add_constant=True):
+    results = {}
+    for name, (y, x) in specifications.items():
+        fitted = fit_grouped_ols(df, y, x, by, add_constant)
+        for key, table in fitted.items():
+            results[(name, key)] = table
+    return results
+
+
+# Copy the rows of every window of `window` consecutive periods into one
+# frame, numbered in a "Window" column, so rolling fits are grouped fits
+# by "Window"
+def rolling_windows(df, window, order=("Year", "Month")):
+    df = df.sort_values(list(order)).reset_index(drop=True)
+    periods = df[list(order)].drop_duplicates().reset_index(drop=True)
+    frames = []
+    for start in range(len(periods) - window + 1):
+        span = periods.iloc[start:start + window]
+        rows = df.merge(span, on=list(order))
+        rows["Window"] = start
+        frames.append(rows)
+    if not frames:
+        return df.iloc[0:0].assign(Window=pd.Series(dtype="int64"))
+    return pd.concat(frames, ignore_index=True)
+
+
+# One batch of resampling replicates of the regression of y (n,) on X (n, k).
+# "bootstrap" resamples rows with replacement and returns the coefficients,
+# "permutation" shuffles y against X and returns the t values.
+def _resample_batch(task):
+    method, X, y, size, seed = task
+    rng = np.random.default_rng(seed)
+    n = len(y)
+    if method == "bootstrap":
+        rows = rng.integers(0, n, size=(size, n))
+        return batch_ols(X[rows], y[rows])["params"]
+    if method == "permutation":
+        rows = rng.permuted(np.tile(np.arange(n), (size, 1)), axis=1)
+        X_stack = np.broadcast_to(X, (size,) + X.shape)
+        return batch_ols(X_stack, y[rows])["tvalues"]
+    raise ValueError(f"Unknown resampling method {method!r}")
+
+
+# Bootstrap percentile intervals and permutation p values for the regression
+# of y on x in every group of `by`, next to the usual results table.
+# Replicates are split into batches with their own seed spawned from `seed`,
+# so results only depend on seed and batch_size, not on the worker count.
+def resample_grouped_ols(
+    df,
+    y,
+    x,
+    by="Year",
+    n_replicates=1000,
+    seed=0,
+    workers=None,
+    batch_size=250,
+    confidence=0.95,
+    pool=None,
+):
+    keys, names, X, Y, nobs = stack_groups(df, y, x, by)
+    if not keys:
+        return {}
+    fit = batch_ols(X, Y, nobs)
+
+    sizes = [
+        min(batch_size, n_replicates - start)
+        for start in range(0, n_replicates, batch_size)
+    ]
+    group_seeds = np.random.SeedSequence(seed).spawn(len(keys))
+    tasks = []
+    for index, group_seed in enumerate(group_seeds):
+        X_group, y_group = X[index, :nobs[index]], Y[index, :nobs[index]]
+        for method, method_seed in zip(
+            ["bootstrap", "permutation"], group_seed.spawn(2)
+        ):
+            for size, batch_seed in zip(sizes, method_seed.spawn(len(sizes))):
+                tasks.append((method, X_group, y_group, size, batch_seed))
+
+    if pool is not None:
+        batches = list(pool.map(_resample_batch, tasks))
+    elif workers == 1:
+        batches = [_resample_batch(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as new_pool:
+            batches = list(new_pool.map(_resample_batch, tasks))
+
+    alpha = (1 - confidence) / 2
+    results = {}
+    per_group = 2 * len(sizes)
+    for index, key in enumerate(keys):
+        group_batches = batches[index * per_group:(index + 1) * per_group]
+        boot_params = np.concatenate(group_batches[:len(sizes)])
+        perm_tvalues = np.concatenate(group_batches[len(sizes):])
+
+        table = format_regression_table(
+            names,
+            fit["params"][index],
+            fit["bse"][index],
+            fit["tvalues"][index],
+            fit["pvalues"][index],
+        )
+        table["Boot CI Lower"] = np.nanquantile(boot_params, alpha, axis=0).round(4)
+        table["Boot CI Upper"] = np.nanquantile(boot_params, 1 - alpha, axis=0).round(4)
+        # Share of permuted |t| at least as large as observed (with the
+        # observed sample counted once), not defined for the constant
+        exceed = np.abs(perm_tvalues) >= np.abs(fit["tvalues"][index])
+        perm_pvalues = (exceed.sum(axis=0) + 1) / (len(perm_tvalues) + 1)
+        if names[0] == "const":
+            perm_pvalues[0] = np.nan
+        table["Perm P"] = np.round(perm_pvalues, 4)
+        results[key] = table
+    return results
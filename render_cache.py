@@ -0,0 +1,71 @@
+"""This file contains the on-disk cache of the rendered dashboard plots."""
+
+import os
+import tempfile
+import matplotlib.pyplot as plt
+from const import RENDER_CACHE_MAX_BYTES, RENDER_CACHE_PATH
+from fingerprint import value_fingerprint
+from storage import apply_default_mode
+
+
+# File of a plot rendered with the given parameters from the given data
+def cache_path(plot, params, data_version, cache_dir=RENDER_CACHE_PATH):
+    key = value_fingerprint([plot, params, data_version])
+    return os.path.join(cache_dir, f"{plot}_{key[:32]}.png")
+
+
+# Return the PNG of a plot, calling render() for its figure only on a miss.
+# The figure is saved to a unique temporary file and renamed into place, so
+# concurrent sessions never read or overwrite a partial image.
+def cached_render(
+    plot,
+    params,
+    data_version,
+    render,
+    cache_dir=RENDER_CACHE_PATH,
+    max_bytes=RENDER_CACHE_MAX_BYTES,
+):
+    target = cache_path(plot, params, data_version, cache_dir)
+    if os.path.exists(target):
+        # Refresh the mtime, which orders the eviction
+        os.utime(target)
+        return target
+
+    os.makedirs(cache_dir, exist_ok=True)
+    fig = render()
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=f".{plot}_", suffix=".png")
+    os.close(fd)
+    try:
+        fig.savefig(tmp_path)
+        apply_default_mode(tmp_path)
+        os.replace(tmp_path, target)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    finally:
+        plt.close(fig)
+
+    evict(cache_dir, max_bytes)
+    return target
+
+
+# Delete the least recently used images until the cache fits in max_bytes
+def evict(cache_dir=RENDER_CACHE_PATH, max_bytes=RENDER_CACHE_MAX_BYTES):
+    images = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(".png") and not entry.name.startswith("."):
+            stat = entry.stat()
+            images.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in images)
+    removed = []
+    for _, size, image_path in sorted(images):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(image_path)
+        except FileNotFoundError:
+            continue
+        total -= size
+        removed.append(image_path)
+    return removed
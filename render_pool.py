@@ -0,0 +1,67 @@
+"""This file contains the background pool rendering the dashboard plots."""
+
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from const import DATA_PATH, RENDER_POOL, RENDER_WORKERS
+from plotting import DASHBOARD_PLOTS, render_dashboard_plot
+
+
+# Worker processes render with the headless backend, whatever the server uses
+def _init_worker():
+    import matplotlib
+
+    matplotlib.use("Agg")
+
+
+# Renders dashboard plots into the render cache off the event loop, with at
+# most `max_workers` renders at a time. Identical (plot, year) requests made
+# while one is in flight await the same render instead of starting another.
+# pyplot keeps global state, so the "process" kind (the default) renders in
+# separate processes; the "thread" kind renders one plot at a time.
+class RenderPool:
+    def __init__(self, max_workers=RENDER_WORKERS, kind=RENDER_POOL, path=DATA_PATH):
+        if kind == "process":
+            self._executor = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+        elif kind == "thread":
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        else:
+            raise ValueError(f"Unknown render pool kind {kind!r}")
+        self.path = path
+        self._in_flight = {}
+
+    # Path of the cached image of a plot, rendered in the pool if needed
+    async def render(self, plot, year):
+        key = (plot, int(year))
+        future = self._in_flight.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(
+                self._executor, render_dashboard_plot, plot, int(year), self.path
+            )
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # A cancelled request must not cancel the render other requests await
+        return await asyncio.shield(future)
+
+    # Start rendering the plots of a year in the background, e.g. the tabs
+    # not shown yet, so switching to them is served from the cache
+    def prefetch(self, year, plots=None):
+        plots = list(DASHBOARD_PLOTS) if plots is None else plots
+        return [
+            asyncio.ensure_future(self._prefetch_one(plot, year)) for plot in plots
+        ]
+
+    async def _prefetch_one(self, plot, year):
+        try:
+            await self.render(plot, year)
+        except Exception as error:
+            # A failed prefetch is retried, and reported, by the real request
+            print(f"Prefetch of {plot} {year} failed: {error!r}")
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
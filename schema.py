@@ -0,0 +1,74 @@
+"""This file contains the column schema of every processed dataset."""
+
+import pandas as pd
+from countries import COUNTRY_DTYPE
+
+# Labels produced by the sentiment analysis
+SENTIMENT_LABELS = ["Positive", "Negative", "Neutral"]
+
+# Column order and dtype of each processed dataset: categoricals for the
+# low-cardinality strings (the shared country index for Country) and small
+# integers for the calendar fields
+SCHEMAS = {
+    "Carbon": {
+        "Country": COUNTRY_DTYPE,
+        "Year": "int16",
+        "Month": "int8",
+        "Sector": "category",
+        "Value": "float64",
+    },
+    # Reddit posts, numbered by Post Key, and their comments
+    "RedditPosts": {
+        "Post Key": "int32",
+        "Post ID": "object",
+        "Year": "int16",
+        "Month": "int8",
+        "Title": "object",
+        "Post": "object",
+        "Topic": "category",
+    },
+    "Reddit": {
+        "Post Key": "int32",
+        "Comment": "object",
+        "Comment_Sentiment": pd.CategoricalDtype(SENTIMENT_LABELS),
+        "Comment_Polarity": "float32",
+    },
+    "Disaster": {
+        "Disaster Type": "category",
+        "Country": COUNTRY_DTYPE,
+        "Year": "int16",
+        "Month": "int8",
+        "Total Deaths": "float64",
+    },
+    "Temperature": {
+        "Year": "int16",
+        "Month": "int8",
+        "Monthly Anomaly": "float64",
+        "Monthly Uncertainty": "float64",
+        "Country": COUNTRY_DTYPE,
+    },
+    "WordFrequency": {
+        "Word": "object",
+        "Count": "int64",
+    },
+    "Cube": {
+        "Dataset": "category",
+        "Year": "int16",
+        "Month": "int8",
+        "Country": COUNTRY_DTYPE,
+        "Dimension": "category",
+        "Category": "category",
+        "Measure": "category",
+        "Count": "int64",
+        "Sum": "float64",
+    },
+}
+
+
+# Order and cast the columns of a processed dataset according to its schema.
+# Columns missing from the frame (e.g. dropped text columns) are skipped.
+def apply_schema(df, name):
+    schema = {
+        column: dtype for column, dtype in SCHEMAS[name].items() if column in df
+    }
+    return df[list(schema)].astype(schema)
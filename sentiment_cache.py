@@ -0,0 +1,114 @@
+"""This file contains the on-disk cache of comment sentiment polarities."""
+
+import hashlib
+import sqlite3
+import time
+from importlib.metadata import version
+from const import SENTIMENT_CACHE_MAX_ENTRIES
+
+# Part of every key, so upgrading TextBlob does not serve stale polarities
+SENTIMENT_MODEL = f"textblob-{version('textblob')}"
+
+# SQLite limits the number of parameters of a single statement
+_BATCH_SIZE = 500
+
+
+def hash_text(text, model=SENTIMENT_MODEL):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(model.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(text.encode("utf-8"))
+    return digest.digest()
+
+
+# SQLite table mapping the hash of a text to its polarity. Entries that were
+# not used for the longest time are evicted beyond max_entries.
+class SentimentCache:
+    def __init__(self, db_path, max_entries=SENTIMENT_CACHE_MAX_ENTRIES):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS sentiment ("
+            "key BLOB PRIMARY KEY, polarity REAL NOT NULL, "
+            "last_used REAL NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS sentiment_last_used "
+            "ON sentiment (last_used)"
+        )
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def __len__(self):
+        query = "SELECT COUNT(*) FROM sentiment"
+        return self.connection.execute(query).fetchone()[0]
+
+    # Cached polarity of each text, None for the texts never scored
+    def get_many(self, texts):
+        keys = [hash_text(text) for text in texts]
+        found = {}
+        for start in range(0, len(keys), _BATCH_SIZE):
+            batch = keys[start:start + _BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            rows = self.connection.execute(
+                f"SELECT key, polarity FROM sentiment WHERE key IN ({placeholders})",
+                batch,
+            )
+            found.update(rows)
+
+        now = time.time()
+        self.connection.executemany(
+            "UPDATE sentiment SET last_used = ? WHERE key = ?",
+            [(now, key) for key in found],
+        )
+        self.connection.commit()
+
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return [found.get(key) for key in keys]
+
+    def put_many(self, texts, polarities):
+        now = time.time()
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO sentiment (key, polarity, last_used) "
+            "VALUES (?, ?, ?)",
+            [
+                (hash_text(text), float(polarity), now)
+                for text, polarity in zip(texts, polarities)
+            ],
+        )
+        self.connection.commit()
+        self.evict()
+
+    # Drop the least recently used entries beyond max_entries
+    def evict(self):
+        excess = len(self) - self.max_entries
+        if excess > 0:
+            self.connection.execute(
+                "DELETE FROM sentiment WHERE key IN ("
+                "SELECT key FROM sentiment ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+            self.connection.commit()
+        return max(excess, 0)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self),
+        }
@@ -1,9 +1,25 @@
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
 from textblob import TextBlob
+from const import (
+    SENTIMENT_CHUNK_SIZE,
+    SENTIMENT_WORKERS,
+    TOPIC_CONFIG_PATH,
+    TOPIC_KEYWORDS,
+)
+from profiling import profiled
 
-def analyze_sentiment(text):
-    # Using TextBlob for simplicity
-    testimonial = TextBlob(text)
-    polarity = testimonial.sentiment.polarity
+def score_polarity(text):
+    # Using TextBlob for simplicity, missing texts are neutral
+    if not isinstance(text, str):
+        return 0.0
+    return TextBlob(text).sentiment.polarity
+
+def label_polarity(polarity):
     # Categorize as positive, negative, or neutral based on polarity
     if polarity > 0:
         return "Positive"
@@ -12,73 +28,112 @@ def analyze_sentiment(text):
     else:
         return "Neutral"
 
-def analyze_title_topics(title):
-    # Define keywords for each topic
-    keywords = {
-        "Seriousness of gas emissions": ["emission", "gas", "CO2", "carbon", "methane"],
-        "Importance of human intervention": [
-            "human intervention",
-            "climate action",
-            "reduce emissions",
-            "environmental policy",
-        ],
-        "Global stance": [
-            "global",
-            "international",
-            "world",
-            "countries",
-            "UN",
-            "Paris Agreement",
-        ],
-        "Significance of pollution awareness events": [
-            "event",
-            "awareness",
-            "Earth Day",
-            "campaign",
-            "environmental day",
-        ],
-        "Weather extremes": [
-            "extreme weather",
-            "heatwave",
-            "flood",
-            "drought",
-            "hurricane",
-            "storm",
-        ],
-        "Impact of resource overconsumption": [
-            "overconsumption",
-            "resource depletion",
-            "overuse",
-            "waste",
-            "consumption",
-        ],
-        "Donald Trump versus science": [
-            "Trump",
-            "Donald Trump",
-            "administration",
-            "climate denial",
-        ],
-        "Ideological positions on global warming": [
-            "ideology",
-            "belief",
-            "skeptic",
-            "denier",
-            "activist",
-            "environmentalist",
-        ],
-        "Politics": [
-            "politics",
-            "policy",
-            "government",
-            "regulation",
-            "law",
-            "legislation",
+def analyze_sentiment(text):
+    return label_polarity(score_polarity(text))
+
+def _score_chunk(texts):
+    return [score_polarity(text) for text in texts]
+
+# Score the sentiment of a Series of texts. Identical texts are scored once,
+# texts found in the optional SentimentCache are not scored again, and the
+# rest are split into chunks scored across a process pool.
+# Returns the raw polarity and its Positive/Negative/Neutral label.
+@profiled
+def analyze_sentiment_batch(
+    texts, workers=SENTIMENT_WORKERS, chunk_size=SENTIMENT_CHUNK_SIZE, cache=None
+):
+    texts = pd.Series(texts)
+    codes, uniques = pd.factorize(texts)
+    uniques = list(uniques)
+
+    if cache is not None:
+        unique_polarity = cache.get_many(uniques)
+    else:
+        unique_polarity = [None] * len(uniques)
+    to_score = [
+        text for text, polarity in zip(uniques, unique_polarity) if polarity is None
+    ]
+    chunks = [
+        to_score[start:start + chunk_size]
+        for start in range(0, len(to_score), chunk_size)
+    ]
+
+    if workers == 1 or len(chunks) <= 1:
+        scores = [_score_chunk(chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            scores = list(pool.map(_score_chunk, chunks))
+    new_scores = [score for chunk in scores for score in chunk]
+    if cache is not None and to_score:
+        cache.put_many(to_score, new_scores)
+
+    new_scores = iter(new_scores)
+    unique_polarity = np.array(
+        [
+            next(new_scores) if polarity is None else polarity
+            for polarity in unique_polarity
         ],
-        "Undefined": [],
-    }
+        dtype="float64",
+    )
+    # Missing texts are factorized to -1 and scored as neutral
+    polarity = np.zeros(len(texts), dtype="float64")
+    polarity[codes >= 0] = unique_polarity[codes[codes >= 0]]
+    sentiment = np.select(
+        [polarity > 0, polarity < 0], ["Positive", "Negative"], "Neutral"
+    )
+
+    return pd.DataFrame(
+        {"Polarity": polarity, "Sentiment": sentiment}, index=texts.index
+    )
+
+# Load a topic table {topic: [keywords]} from a JSON config file. Topics are
+# matched in file order, so earlier topics take priority.
+def load_topic_keywords(config_path):
+    with open(config_path) as file:
+        return json.load(file)
 
-    # Check each keyword in the title and assign the corresponding topic
-    for topic, key_list in keywords.items():
-        if any(key.lower() in title.lower() for key in key_list):
+# The topic table in use: the TOPIC_CONFIG_PATH file if there is one, else
+# the TOPIC_KEYWORDS defaults
+def configured_topic_keywords(config_path=TOPIC_CONFIG_PATH):
+    if config_path and os.path.exists(config_path):
+        return load_topic_keywords(config_path)
+    return TOPIC_KEYWORDS
+
+# Compile one case-insensitive substring pattern per topic, in priority order
+def compile_topic_patterns(keywords=None):
+    if keywords is None:
+        keywords = configured_topic_keywords()
+    return [
+        (topic, re.compile("|".join(map(re.escape, key_list)), re.IGNORECASE))
+        for topic, key_list in keywords.items()
+        if key_list
+    ]
+
+DEFAULT_TOPIC_PATTERNS = compile_topic_patterns()
+
+def analyze_title_topics(title, patterns=DEFAULT_TOPIC_PATTERNS):
+    # Assign the first topic with a keyword in the title
+    for topic, pattern in patterns:
+        if pattern.search(title):
             return topic
     return "Undefined"
+
+# Classify a whole Series of titles. Each distinct title is classified once,
+# one vectorized pass per topic, keeping the first matching topic.
+@profiled
+def classify_title_topics(titles, patterns=DEFAULT_TOPIC_PATTERNS):
+    titles = pd.Series(titles)
+    codes, uniques = pd.factorize(titles)
+    uniques = pd.Series(uniques, dtype="object")
+
+    unique_topics = np.full(len(uniques), "Undefined", dtype="object")
+    unassigned = np.ones(len(uniques), dtype=bool)
+    for topic, pattern in patterns:
+        matches = uniques.str.contains(pattern, na=False).to_numpy() & unassigned
+        unique_topics[matches] = topic
+        unassigned &= ~matches
+
+    # Missing titles are factorized to -1 and stay undefined
+    topics = np.full(len(titles), "Undefined", dtype="object")
+    topics[codes >= 0] = unique_topics[codes[codes >= 0]]
+    return pd.Series(topics, index=titles.index)
@@ -0,0 +1,107 @@
+"""This file contains the columnar storage used for the processed datasets."""
+
+import os
+import stat
+import tempfile
+import threading
+from functools import lru_cache
+import pandas as pd
+
+# Parquet needs pyarrow, without it the datasets are stored as CSV only
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+def parquet_path(name, path):
+    return os.path.join(path, f"{name}.parquet")
+
+
+def csv_path(name, path):
+    return os.path.join(path, f"{name}.csv")
+
+
+def dataset_exists(name, path):
+    return os.path.exists(parquet_path(name, path)) or os.path.exists(
+        csv_path(name, path)
+    )
+
+
+# Permissions a plain open() gives new files in a directory, read from a
+# probe file created there. Reading the umask itself means setting it for a
+# moment, and threads creating files meanwhile would get the wrong mode.
+@lru_cache(maxsize=None)
+def _default_mode(directory):
+    probe = os.path.join(
+        directory, f".mode-probe.{os.getpid()}.{threading.get_ident()}"
+    )
+    fd = os.open(probe, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        return stat.S_IMODE(os.fstat(fd).st_mode)
+    finally:
+        os.close(fd)
+        os.remove(probe)
+
+
+# mkstemp creates owner-only files, give a temporary file the permissions a
+# plain open() would before it is renamed into place
+def apply_default_mode(file_path):
+    os.chmod(file_path, _default_mode(os.path.dirname(os.path.abspath(file_path))))
+
+
+# Write to a temporary file next to the target, then rename it into place
+def _atomic_write(target, write):
+    directory, file_name = os.path.split(target)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{file_name}.")
+    os.close(fd)
+    try:
+        write(tmp_path)
+        apply_default_mode(tmp_path)
+        os.replace(tmp_path, target)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+# Store a processed dataset as Parquet, which keeps its dtypes, with an
+# optional CSV export. CSV is the only output when pyarrow is not installed.
+def write_dataset(df, name, path, export_csv=False):
+    if pq is not None:
+        _atomic_write(
+            parquet_path(name, path),
+            lambda target: df.to_parquet(target, index=False),
+        )
+    if export_csv or pq is None:
+        _atomic_write(
+            csv_path(name, path), lambda target: df.to_csv(target, index=False)
+        )
+    return df
+
+
+# Read a processed dataset, loading only the requested columns and years.
+# With Parquet the year filter is pushed down to the row groups, with CSV
+# the dtypes given as {column: dtype} are restored after parsing.
+def read_dataset(name, path, columns=None, years=None, dtypes=None):
+    if pq is not None and os.path.exists(parquet_path(name, path)):
+        filters = None
+        if years is not None:
+            filters = [("Year", "in", [int(year) for year in years])]
+        df = pd.read_parquet(
+            parquet_path(name, path), columns=columns, filters=filters
+        )
+        return df.reset_index(drop=True)
+
+    usecols = None
+    if columns is not None:
+        usecols = list(columns) + (["Year"] if years is not None else [])
+        usecols = list(dict.fromkeys(usecols))
+    df = pd.read_csv(csv_path(name, path), usecols=usecols)
+    if years is not None:
+        df = df[df["Year"].isin(years)]
+    if columns is not None:
+        df = df[columns]
+    if dtypes is not None:
+        df = df.astype(
+            {column: dtype for column, dtype in dtypes.items() if column in df}
+        )
+    return df.reset_index(drop=True)
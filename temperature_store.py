@@ -0,0 +1,211 @@
+"""This file contains the Berkeley Earth parser and the per-country temperature store."""
+
+import json
+import os
+import re
+import numpy as np
+import pandas as pd
+from const import TEMPERATURE_STORE_DIR
+from storage import _atomic_write
+
+TEMPERATURE_COLUMNS = [
+    "Year",
+    "Month",
+    "Monthly Anomaly",
+    "Monthly Uncertainty",
+    "Annual Anomaly",
+    "Annual Uncertainty",
+    "Five-year Anomaly",
+    "Five-year Uncertainty",
+    "Ten-year Anomaly",
+    "Ten-year Uncertainty",
+    "Twenty-year Anomaly",
+    "Twenty-year Uncertainty",
+]
+
+# Columns kept in the store, the year and month being the row index
+STORE_COLUMNS = TEMPERATURE_COLUMNS[2:]
+
+STORE_INDEX_NAME = "index.json"
+
+
+# Parse a Berkeley Earth text file: "%" comment lines, then rows of
+# whitespace separated numbers with NaN for the missing values. Files with
+# several tables (e.g. the global land and ocean series, with sea ice
+# inferred from air then from water temperatures) have their rows one table
+# after the other, as in the combined file.
+def parse_berkeley_earth(file_path, columns=TEMPERATURE_COLUMNS):
+    rows = []
+    with open(file_path) as file:
+        for line in file:
+            line = line.strip()
+            if line and not line.startswith("%"):
+                rows.append(line)
+
+    values = np.fromstring(" ".join(rows), sep=" ")
+    if values.size != len(rows) * len(columns):
+        raise ValueError(
+            f"{file_path} does not have {len(columns)} numbers on every row"
+        )
+    data = pd.DataFrame(values.reshape(len(rows), len(columns)), columns=columns)
+    return data.astype({"Year": "int64", "Month": "int64"})
+
+
+def _store_path(path):
+    return os.path.join(path, TEMPERATURE_STORE_DIR)
+
+
+def _source_stat(source):
+    stat = os.stat(source)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+# File name of a country's array, e.g. "United Kingdom" -> "united_kingdom.npy"
+def _array_name(country):
+    return re.sub(r"\W+", "_", str(country)).strip("_").lower() + ".npy"
+
+
+# Months counted from year 0, the position of a (year, month) in the store
+def month_number(year, month):
+    return year * 12 + month - 1
+
+
+# Key of the n-th series of a country, e.g. "WORLD" then "WORLD (2)"
+def _series_key(country, variant):
+    return str(country) if variant == 0 else f"{country} ({variant + 1})"
+
+
+# Write the rows of every country (TEMPERATURE_COLUMNS and Country) as one
+# array of STORE_COLUMNS per series, a row per month from its first one, so
+# a year range is a slice. A country whose months come more than once (the
+# tables of the global file) gets one series per table, in file order.
+# `source` is the combined file the rows came from, the store is only used
+# while that file is unchanged.
+def write_temperature_store(df, path, source=None):
+    store_path = _store_path(path)
+    os.makedirs(store_path, exist_ok=True)
+    index = {
+        "columns": STORE_COLUMNS,
+        "source": _source_stat(source) if source is not None else None,
+        "series": {},
+    }
+    df = df.dropna(subset=["Year", "Month", "Country"])
+    variants = df.groupby(["Country", "Year", "Month"], observed=True).cumcount()
+    for (country, variant), rows in df.groupby(
+        [df["Country"], variants], sort=False, observed=True
+    ):
+        numbers = month_number(
+            rows["Year"].to_numpy(dtype="int64"), rows["Month"].to_numpy(dtype="int64")
+        )
+        start = int(numbers.min())
+        positions = numbers - start
+        array = np.full((positions.max() + 1, len(STORE_COLUMNS)), np.nan)
+        array[positions] = rows.reindex(columns=STORE_COLUMNS).to_numpy(dtype="float64")
+
+        def save(target, array=array):
+            with open(target, "wb") as file:
+                np.save(file, array)
+
+        key = _series_key(country, variant)
+        file_name = _array_name(key)
+        _atomic_write(os.path.join(store_path, file_name), save)
+        index["series"][key] = {
+            "country": str(country),
+            "file": file_name,
+            "start": start,
+        }
+
+    # Written last, so a store interrupted while writing is never used
+    def save_index(target):
+        with open(target, "w") as file:
+            json.dump(index, file, indent=2)
+
+    _atomic_write(os.path.join(store_path, STORE_INDEX_NAME), save_index)
+    return TemperatureStore(path)
+
+
+# The store of `path`, or None if it was never written, was written before
+# the countries had several series, or its `source` changed since
+def load_temperature_store(path, source=None):
+    try:
+        store = TemperatureStore(path)
+    except FileNotFoundError:
+        return None
+    if "series" not in store.index:
+        return None
+    if source is not None and store.index["source"] != _source_stat(source):
+        return None
+    return store
+
+
+# Read side of the store: each series' array is memory-mapped on first use,
+# and slicing a year range returns a view of the mapped file
+class TemperatureStore:
+    def __init__(self, path):
+        self.path = _store_path(path)
+        with open(os.path.join(self.path, STORE_INDEX_NAME)) as file:
+            self.index = json.load(file)
+        self.columns = self.index["columns"]
+        self._arrays = {}
+
+    @property
+    def countries(self):
+        return list(
+            dict.fromkeys(entry["country"] for entry in self.index["series"].values())
+        )
+
+    # Keys of the series of a country, one per table of its source file
+    def series(self, country):
+        return [
+            key
+            for key, entry in self.index["series"].items()
+            if entry["country"] == country
+        ]
+
+    def array(self, key):
+        if key not in self._arrays:
+            entry = self.index["series"][key]
+            self._arrays[key] = np.load(
+                os.path.join(self.path, entry["file"]), mmap_mode="r"
+            )
+        return self._arrays[key]
+
+    # Rows of the months of start_year to end_year (both included) of a
+    # series, and the month number of the first row
+    def slice(self, key, start_year, end_year=None):
+        if end_year is None:
+            end_year = start_year
+        first = self.index["series"][key]["start"]
+        array = self.array(key)
+        start = min(max(month_number(start_year, 1) - first, 0), len(array))
+        stop = min(max(month_number(end_year, 13) - first, start), len(array))
+        return array[start:stop], first + start
+
+    # Frame of the countries (all by default) and years, with the columns of
+    # the combined file: the rows of every series of a country, one series
+    # after the other
+    def frame(self, countries=None, years=None):
+        countries = self.countries if countries is None else list(countries)
+        keys = [key for country in countries for key in self.series(country)]
+        frames = []
+        for key in keys:
+            country = self.index["series"][key]["country"]
+            if years is None:
+                first = self.index["series"][key]["start"]
+                last = first + len(self.array(key)) - 1
+                ranges = [(first // 12, last // 12)]
+            else:
+                ranges = [(year, year) for year in sorted(set(int(year) for year in years))]
+            for start_year, end_year in ranges:
+                rows, start = self.slice(key, start_year, end_year)
+                if not len(rows):
+                    continue
+                numbers = np.arange(start, start + len(rows))
+                frame = pd.DataFrame(np.asarray(rows), columns=self.columns)
+                frame.insert(0, "Year", numbers // 12)
+                frame.insert(1, "Month", numbers % 12 + 1)
+                frame["Country"] = country
+                frames.append(frame)
+        if not frames:
+            return pd.DataFrame(columns=["Year", "Month"] + self.columns + ["Country"])
+        return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,152 @@
+"""Tests of download_data.py against a local HTTP stand-in for the sources."""
+
+import hashlib
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd
+import pytest
+from download_data import download_files, download_main, make_session
+
+BERKELEY_EARTH = """% Berkeley Earth stand-in
+%
+%  Year Month  Anomaly Unc.  Anomaly Unc.  Anomaly Unc.  Anomaly Unc.  Anomaly Unc.
+  2019     1    0.1  0.2    NaN  NaN    NaN  NaN    NaN  NaN    NaN  NaN
+  2019     2   -0.3  0.2    NaN  NaN    NaN  NaN    NaN  NaN    NaN  NaN
+"""
+
+
+# Serves `files` with an ETag, answering If-None-Match with 304 and Range
+# with 206 under a matching If-Range. Paths in `cut` have their first
+# response dropped halfway through the body, paths in `fail` always get
+# their error status.
+class SourceHandler(BaseHTTPRequestHandler):
+    files = {}
+    cut = set()
+    fail = {}
+    log = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.log.append((self.path, dict(self.headers)))
+        body = self.files.get(self.path)
+        if self.path in self.fail or body is None:
+            self.send_error(self.fail.get(self.path, 404))
+            return
+        etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        start = 0
+        range_header = self.headers.get("Range")
+        if range_header and self.headers.get("If-Range") == etag:
+            start = int(range_header.split("=")[1].rstrip("-"))
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}"
+            )
+        else:
+            self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(len(body) - start))
+        self.end_headers()
+
+        if self.path in self.cut:
+            self.cut.discard(self.path)
+            self.wfile.write(body[start : start + (len(body) - start) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body[start:])
+
+
+@pytest.fixture
+def server():
+    SourceHandler.files = {
+        "/Carbon.csv": b"country,date,sector,value\n"
+        + b"China,01/01/2019,Power,1.5\n" * 20000,
+        "/china-TAVG-Trend.txt": BERKELEY_EARTH.encode(),
+        "/Land_and_Ocean_complete.txt": BERKELEY_EARTH.encode(),
+    }
+    SourceHandler.cut = set()
+    SourceHandler.fail = {"/unavailable.csv": 503}
+    SourceHandler.log = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), SourceHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def sources(base_url):
+    return {
+        "carbon_url": f"{base_url}/Carbon.csv",
+        "temperature_urls": [
+            (f"{base_url}/china-TAVG-Trend.txt", "China"),
+            (f"{base_url}/Land_and_Ocean_complete.txt", "WORLD"),
+        ],
+    }
+
+
+def test_downloads_and_combines_every_source(server, tmp_path):
+    results = download_main(str(tmp_path), offline=False, **sources(server))
+
+    assert all(results.values())
+    assert (tmp_path / "Carbon.csv").read_bytes() == SourceHandler.files["/Carbon.csv"]
+    combined = pd.read_csv(tmp_path / "Anomaly_Temp.csv")
+    assert combined["Country"].value_counts().to_dict() == {"China": 2, "WORLD": 2}
+    assert combined["Monthly Anomaly"].tolist() == [0.1, -0.3, 0.1, -0.3]
+
+
+def test_unchanged_sources_are_skipped(server, tmp_path):
+    download_main(str(tmp_path), offline=False, **sources(server))
+    SourceHandler.log.clear()
+
+    results = download_main(str(tmp_path), offline=False, **sources(server))
+
+    assert not any(results.values())
+    assert all("If-None-Match" in headers for _, headers in SourceHandler.log)
+
+
+def test_interrupted_download_resumes_from_the_part(server, tmp_path):
+    SourceHandler.cut = {"/Carbon.csv"}
+
+    results = download_main(str(tmp_path), offline=False, **sources(server))
+
+    target = tmp_path / "Carbon.csv"
+    assert results[str(target)]
+    assert target.read_bytes() == SourceHandler.files["/Carbon.csv"]
+    assert not os.path.exists(str(target) + ".part")
+    carbon_requests = [
+        headers for path, headers in SourceHandler.log if path == "/Carbon.csv"
+    ]
+    assert len(carbon_requests) == 2
+    assert carbon_requests[1]["Range"].startswith("bytes=")
+    assert carbon_requests[1]["Range"] != "bytes=0-"
+
+
+def test_failed_requests_are_only_retried_by_the_session(server, tmp_path):
+    downloads = [
+        (f"{server}/missing.csv", str(tmp_path / "missing.csv")),
+        (f"{server}/unavailable.csv", str(tmp_path / "unavailable.csv")),
+    ]
+
+    results = download_files(downloads, make_session(retries=2))
+
+    assert list(results.values()) == [None, None]
+    requested = [path for path, _ in SourceHandler.log]
+    # A 404 is final, a 503 is retried by the session's adapter only
+    assert requested.count("/missing.csv") == 1
+    assert requested.count("/unavailable.csv") == 3
+
+
+def test_offline_mode_does_not_touch_the_network(server, tmp_path):
+    assert download_main(str(tmp_path), offline=True, **sources(server)) is None
+    assert SourceHandler.log == []
@@ -0,0 +1,62 @@
+"""This file contains the streaming word counts behind the word cloud."""
+
+import re
+from collections import Counter, defaultdict
+import pandas as pd
+from wordcloud import STOPWORDS
+
+# Words as WordCloud splits them from a text
+TOKEN_PATTERN = re.compile(r"\w[\w']*")
+
+
+# One case-insensitive regex matching any of the keywords
+def compile_keyword_matcher(keywords):
+    return re.compile(
+        "|".join(re.escape(keyword) for keyword in keywords), re.IGNORECASE
+    )
+
+
+# Add the raw token counts of the comments mentioning a keyword to `counts`.
+# Tokens are counted per chunk with pandas, so no text is ever concatenated.
+def count_tokens(comments, matcher, counts=None):
+    if counts is None:
+        counts = Counter()
+    comments = pd.Series(comments).dropna().astype(str)
+    comments = comments[comments.str.contains(matcher)]
+    if len(comments):
+        tokens = comments.str.findall(TOKEN_PATTERN).explode().dropna()
+        # In order of first appearance, which breaks ties between word cases
+        counts.update(tokens.value_counts(sort=False).to_dict())
+    return counts
+
+
+# Word frequencies from raw token counts, cleaned like WordCloud.process_text
+# does without collocations: "'s" endings, numbers and stopwords are removed,
+# plurals are merged into their singular and each word is shown in its most
+# common case. Returns a frame of Word and Count, most frequent first.
+def word_frequencies(counts, stopwords=()):
+    stopwords = {word.lower() for word in set(STOPWORDS) | set(stopwords)}
+
+    cases = defaultdict(Counter)
+    for token, count in counts.items():
+        if token.lower().endswith("'s"):
+            token = token[:-2]
+        if token.isdigit() or token.lower() in stopwords:
+            continue
+        cases[token.lower()][token] += count
+
+    for key in list(cases):
+        if key.endswith("s") and not key.endswith("ss") and key[:-1] in cases:
+            for word, count in cases.pop(key).items():
+                cases[key[:-1]][word[:-1]] += count
+
+    frequencies = pd.DataFrame(
+        [
+            (max(variants.items(), key=lambda item: item[1])[0], sum(variants.values()))
+            for variants in cases.values()
+        ],
+        columns=["Word", "Count"],
+    )
+    return frequencies.sort_values(
+        "Count", ascending=False, kind="stable"
+    ).reset_index(drop=True)